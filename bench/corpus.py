@@ -0,0 +1,102 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : corpus.py
+# Description  : 性能测试用的合成资讯数据, 按固定随机种子生成, 保证每次测试数据一致
+#******************************************************************************
+
+import random
+import datetime
+from bson.objectid import ObjectId
+
+COMPANIES = ["华为技术有限公司", "科大讯飞股份有限公司", "商汤科技", "宁德时代新能源科技股份有限公司", "比亚迪股份有限公司",
+             "药明康德", "恒瑞医药", "中兴通讯股份有限公司", "大疆创新", "旷视科技", "舜宇光学", "高德软件"]
+INDUSTRIES = ["人工智能", "地理信息", "生物制药", "医疗器械", "光电产业", "新能源汽车", "5G产业"]
+EVENTS = ["企业合作", "投融资", "中标招标", "领导考察", "公司上市", "企业获奖", "高管变动", "会议动态", "企业收购"]
+DOMAINS = ["计算机视觉", "语音识别", "动力电池", "创新药", "基站设备"]
+
+## 生成标题与正文用的常用字
+CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理府研质"
+
+
+def make_entity(company):
+    return {
+        "name": company,
+        "type": "company",
+        "externalReference": {"id": "company/{}".format(COMPANIES.index(company) if company in COMPANIES else 0), "name": company}
+    }
+
+
+def make_tags(rand):
+    return [
+        {"name": rand.choice(INDUSTRIES), "conceptId": "", "conceptName": "产业"},
+        {"name": rand.choice(DOMAINS), "conceptId": "", "conceptName": "产业领域"},
+        {"name": rand.choice(EVENTS), "conceptId": "", "conceptName": "事件"}
+    ]
+
+
+def make_text(rand, length):
+    sentences = []
+    total = 0
+    while total < length:
+        sentence = "".join(rand.choice(CHARS) for _ in range(rand.randint(15, 40)))
+        sentences.append(sentence)
+        total += len(sentence) + 1
+    return "。".join(sentences) + "。"
+
+
+## 采集库中的原始公众号资讯(mongodb)
+def crawl_docs(size, date_str, content_length=2000, html_length=8000, seed=1):
+    rand = random.Random(seed)
+    process_date = datetime.datetime.strptime(date_str, "%Y-%m-%d")
+    docs = []
+    for i in range(size):
+        crawl_time = process_date + datetime.timedelta(seconds=rand.randint(0, 86399))
+        publish_time = crawl_time - datetime.timedelta(hours=rand.randint(0, 48))
+        docs.append({
+            "_id": ObjectId("{:024x}".format(rand.getrandbits(96))),
+            "source": "公众号",
+            "search_key": rand.choice(COMPANIES),
+            "url": "https://mp.weixin.qq.com/s/{}".format(i),
+            "title": "".join(rand.choice(CHARS) for _ in range(rand.randint(12, 30))),
+            "publish_time": publish_time.strftime("%Y-%m-%d %H:%M"),
+            "crawl_time": crawl_time,
+            "content": make_text(rand, content_length),
+            "html": "<p>" + make_text(rand, html_length) + "</p>",
+            "img_url": ["https://mmbiz.qpic.cn/{}.jpg".format(i)]
+        })
+    return docs
+
+
+## 清洗库中的资讯(mongodb), 即news_partition的输出
+def clean_docs(size, date_str, content_length=2000, seed=2):
+    docs = crawl_docs(size, date_str, content_length, html_length=0, seed=seed)
+    for doc in docs:
+        doc["publish_time"] = doc["publish_time"] + ":00"
+        doc["html"] = ""
+    return docs
+
+
+## kb_news中的资讯(arangodb), 即news_pipeline的输出
+def kb_news_docs(size, date_str, content_length=2000, html_length=8000, seed=3):
+    rand = random.Random(seed)
+    docs = []
+    for doc in crawl_docs(size, date_str, content_length, html_length, seed=seed):
+        create_time = doc["crawl_time"].strftime("%Y-%m-%d %H:%M:%S")
+        docs.append({
+            "_key": str(doc["_id"]),
+            "name": doc["title"],
+            "create_time": create_time,
+            "update_time": create_time,
+            "title": doc["title"],
+            "content": doc["content"],
+            "abstract": doc["content"][ : 120],
+            "url": doc["url"],
+            "html": doc["html"],
+            "img_url": doc["img_url"],
+            "publish_time": doc["publish_time"] + ":00",
+            "source": doc["source"],
+            "tags": make_tags(rand),
+            "entities": [make_entity(doc["search_key"])]
+        })
+    return docs
@@ -0,0 +1,93 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : fake_services.py
+# Description  : 性能测试用的本地http服务, 模拟news pipeline与fragment pipeline接口
+#                返回结构与线上服务一致, 每次请求可配置固定耗时与按资讯数增加的耗时
+#******************************************************************************
+
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import corpus
+
+
+class PipelineHandler(BaseHTTPRequestHandler):
+
+    ## 由make_server设置
+    latency = 0.0               ## 每次请求的固定耗时(秒)
+    per_doc_latency = 0.0       ## 每篇资讯增加的耗时(秒)
+    process = None              ## 单篇资讯的处理函数
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        post_data = json.loads(self.rfile.read(length).decode("utf-8"))
+        documents = post_data.get("documents", [])
+
+        time.sleep(self.latency + self.per_doc_latency * len(documents))
+        body = json.dumps({"body": [self.process(document) for document in documents]}, ensure_ascii=False).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+## news pipeline: 约10%标题过滤, 其余打上产业、事件、领域标签并链接企业
+def news_process(naf):
+    metadata = dict(naf["metadata"])
+    rand = random.Random(metadata["doc_id"])
+    if rand.random() < 0.1:
+        return {"naf": None, "messages": ["标题含有过滤词", None, None, None, None, None]}
+
+    metadata["abstract"] = metadata["content"][ : 120]
+    company = metadata.get("search_key") or rand.choice(corpus.COMPANIES)
+    return {
+        "naf": {
+            "metadata": metadata,
+            "tags": corpus.make_tags(rand),
+            "entities": [corpus.make_entity(company)]
+        },
+        "messages": [None] * 6
+    }
+
+
+## fragment pipeline: 每篇资讯抽取1~3个事件句, 实体为资讯企业加一个随机合作企业
+def fragment_process(doc):
+    rand = random.Random(doc["_key"])
+    sentences = [sentence for sentence in doc["content"].split("。") if sentence][ : rand.randint(1, 3)]
+    emfs = []
+    for sentence in sentences:
+        emfs.append({
+            "section": sentence,
+            "event_type": rand.choice(corpus.EVENTS),
+            "entities": doc.get("entities", []) + [corpus.make_entity("合作企业{}".format(rand.randint(1, 1000)))],
+            "action_words": [],
+            "event_date": doc["publish_time"][ : 10],
+            "publish_time": doc["publish_time"]
+        })
+    naf = {"doc_id": doc["_key"], "title": doc["title"], "publish_time": doc["publish_time"]}
+    if emfs:
+        naf["emfs"] = emfs
+    return {"naf": naf, "messages": []}
+
+
+## 启动本地服务, 返回 (server, url)
+def make_server(process, latency=0.0, per_doc_latency=0.0):
+    handler = type("Handler", (PipelineHandler, ), {
+        "latency": latency,
+        "per_doc_latency": per_doc_latency,
+        "process": staticmethod(process)
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://127.0.0.1:{}/".format(server.server_address[1])
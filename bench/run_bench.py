@@ -0,0 +1,302 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : run_bench.py
+# Description  : 离线性能测试；用本地替身(fakes.py, fake_services.py)代替线上数据库与nlp服务,
+#                按指定数据量运行各任务的process(date_str), 统计 条/秒 与内存峰值,
+#                结果追加到 bench/results/results.jsonl, 并与上一版本的结果对比
+#
+# 用法: python3 bench/run_bench.py --jobs news_pipeline news_arango2es --sizes 200 2000
+#                                  --service-latency 0.05 --per-doc-latency 0.005 --db-latency 0.001
+#******************************************************************************
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import tempfile
+import resource
+import importlib
+import importlib.util
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CODES_DIR = os.path.join(BENCH_DIR, "..", "codes")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results", "results.jsonl")
+
+## 任务模块 -> 任务类名
+JOBS = {
+    "news_partition":           "NewsPartition",
+    "news_pipeline":            "NewsPipeline",
+    "news_fragment_pipeline":   "FragmentPipeline",
+    "news_arango2hbase":        "NewsArango2hbase",
+    "news_arango2mysql":        "NewsArango2mysql",
+    "news_arango2es":           "NewsArango2es",
+    "news_arango2industry_es":  "NewsArango2IndustryEs",
+}
+
+## 测试日期
+BENCH_DATE = "2020-08-20"
+
+## 各任务脚本中被去掉的连接配置, 测试时补齐(脚本中已定义的不覆盖)
+CONFIG = {
+    "MONGO_HOST": "127.0.0.1", "MONGO_PORT": 27017, "MONGO_USER": "bench", "MONGO_PASSWD": "bench",
+    "SOURCE_DB": "news_crawl", "TARGET_DB": "news_clean", "TARGET_PREFIX": "news_",
+    "MONGO_NEWS_DB": "news_clean", "MONGO_NEWS_COLLECTION_PREFIX": "news_",
+    "ARANGO_URL": "http://127.0.0.1:8529", "ARANGO_USER": "bench", "ARANGO_PASSWD": "bench", "ARANGO_DB": "bench",
+    "ARANGO_COLLECTION": "kb_news", "TARGET_COLLECTION": "kb_news_fragment",
+    "ES_URL": "http://127.0.0.1:9200", "ES_INDEX": "news", "ES_TYPE": "_doc",
+    "HBASE_HOST": "127.0.0.1", "HBASE_PORT": 9090, "HBASE_TABLE": "news", "BATCH_SIZE": 100,
+    "MYSQL_HOST": "127.0.0.1", "MYSQL_PORT": 3306, "MYSQL_USER": "bench", "MYSQL_PASSWD": "bench",
+    "MYSQL_DB": "concept", "MYSQL_TABLE": "concept",
+    "AI_DB": "ai", "GEO_DB": "geo", "MED_DB": "med", "OP_DB": "op", "NECAR_DB": "necar", "_5G_DB": "5g",
+}
+
+## 源数据集合: 各任务读取的集合名不同
+SOURCE_COLLECTIONS = {
+    "news_partition": "news_crawl",
+    "news_fragment_pipeline": "kb_news",
+}
+
+
+## 用替身替换已加载的任务模块及公共模块中的数据库客户端
+def install_fakes():
+    import fakes
+    replacements = {
+        "MongoClient": fakes.FakeMongoClient,
+        "ArangoConnection": fakes.FakeArangoConnection,
+        "Elasticsearch": fakes.FakeElasticsearch,
+        "happybase": fakes.FakeHappybase,
+        "pymysql": fakes.FakePymysql,
+    }
+    codes_dir = os.path.realpath(CODES_DIR)
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None) or ""
+        if not os.path.realpath(path).startswith(codes_dir):
+            continue
+        for name, fake in replacements.items():
+            if hasattr(module, name):
+                setattr(module, name, fake)
+
+
+def configure(module, job, service_urls):
+    config = dict(CONFIG)
+    config["SOURCE_COLLECTION"] = SOURCE_COLLECTIONS.get(job, "news_crawl")
+    config["NEWS_PIPELINE_URL"] = service_urls["news"]
+    config["FRAGMENT_PIPELINE_URL"] = service_urls["fragment"]
+    for name, value in config.items():
+        if not hasattr(module, name):
+            setattr(module, name, value)
+
+
+## 准备各任务的输入数据
+def seed(job, module, size, content_length):
+    import corpus
+    import fakes
+    from collections import OrderedDict
+    from fake_services import fragment_process
+
+    date = datetime.datetime.strptime(BENCH_DATE, "%Y-%m-%d")
+    history_date = (date - datetime.timedelta(days=3)).strftime("%Y-%m-%d")
+
+    def arango(name, docs):
+        collection = fakes.FakeStore.arango.setdefault(name, OrderedDict())
+        for doc in docs:
+            collection[doc["_key"]] = doc
+
+    if job == "news_partition":
+        collection = fakes.FakeStore.mongo.setdefault(module.SOURCE_DB, {}).setdefault(module.SOURCE_COLLECTION, OrderedDict())
+        for doc in corpus.crawl_docs(size, BENCH_DATE, content_length):
+            collection[doc["_id"]] = doc
+
+    elif job == "news_pipeline":
+        name = module.MONGO_NEWS_COLLECTION_PREFIX + BENCH_DATE[ : 7].replace("-", "")
+        collection = fakes.FakeStore.mongo.setdefault(module.MONGO_NEWS_DB, {}).setdefault(name, OrderedDict())
+        for doc in corpus.clean_docs(size, BENCH_DATE, content_length):
+            collection[doc["_id"]] = doc
+        ## 去重窗口内的历史资讯
+        arango(module.ARANGO_COLLECTION, corpus.kb_news_docs(size, history_date, content_length, html_length=0, seed=7))
+
+    elif job == "news_fragment_pipeline":
+        arango(module.SOURCE_COLLECTION, corpus.kb_news_docs(size, BENCH_DATE, content_length))
+        ## 近一周的历史事件句
+        fragments = []
+        for doc in corpus.kb_news_docs(size, history_date, content_length, seed=8):
+            for emf in fragment_process(doc)["naf"].get("emfs", []):
+                emf.update({"_key": "h{}".format(len(fragments)), "doc_id": doc["_key"], "title": doc["title"],
+                            "create_time": doc["create_time"], "update_time": doc["update_time"]})
+                fragments.append(emf)
+        arango(module.TARGET_COLLECTION, fragments)
+
+    else:
+        arango(module.ARANGO_COLLECTION, corpus.kb_news_docs(size, BENCH_DATE, content_length))
+        fakes.FakeStore.mysql_concepts = [("公众号", "news", "", "", "", "concept_wechat")]
+
+
+def current_rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+## 子进程中运行单个任务, 结果以json输出到最后一行
+def run_worker(args):
+    sys.path.insert(0, CODES_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    logging.disable(logging.INFO)
+
+    import fakes
+    import fake_services
+    import job_checkpoint
+    import job_metrics
+    import nlp_cache
+    import concept_cache
+
+    ## 断点、缓存、统计文件写到临时目录, 不影响本机的真实数据
+    work_dir = tempfile.mkdtemp(prefix="news_bench_")
+    job_checkpoint.CHECKPOINT_DIR = os.path.join(work_dir, "checkpoints")
+    nlp_cache.CACHE_PATH = os.path.join(work_dir, "cache", "nlp_cache.db")
+    concept_cache.CACHE_DIR = os.path.join(work_dir, "cache")
+    job_metrics.METRICS_DIR = job_metrics.PROM_TEXTFILE_DIR = os.path.join(work_dir, "metrics")
+
+    fakes.reset()
+    fakes.set_call_latency(args.db_latency)
+    news_server, news_url = fake_services.make_server(fake_services.news_process, args.service_latency, args.per_doc_latency)
+    fragment_server, fragment_url = fake_services.make_server(fake_services.fragment_process, args.service_latency, args.per_doc_latency)
+
+    ## 先补齐连接配置再执行脚本, 脚本中用到配置的模块级常量(如行业路由表)才能正常初始化
+    spec = importlib.util.spec_from_file_location(args.worker, os.path.join(CODES_DIR, args.worker + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    configure(module, args.worker, {"news": news_url, "fragment": fragment_url})
+    sys.modules[args.worker] = module
+    spec.loader.exec_module(module)
+    install_fakes()
+    seed(args.worker, module, args.size, args.content_length)
+
+    ## 清零内存峰值, 只统计任务本身(不含测试数据)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except Exception:
+        pass
+    rss_start = current_rss_mb()
+
+    job = getattr(module, JOBS[args.worker])()
+    start_time = time.time()
+    job.process(BENCH_DATE)
+    elapsed = time.time() - start_time
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    news_server.shutdown()
+    fragment_server.shutdown()
+
+    metrics_path = os.path.join(job_metrics.METRICS_DIR, "{}_{}.json".format(args.worker, BENCH_DATE))
+    counts = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path, encoding="utf-8") as f:
+            counts = json.load(f).get("counts", {})
+
+    print(json.dumps({
+        "elapsed_seconds": round(elapsed, 3),
+        "docs_per_second": round(args.size / elapsed, 2) if elapsed else 0,
+        "rss_start_mb": round(rss_start, 1),
+        "peak_rss_mb": round(peak_rss, 1),
+        "peak_delta_mb": round(peak_rss - rss_start, 1),
+        "calls": dict(fakes.CALL_COUNTS),
+        "counts": counts
+    }, ensure_ascii=False))
+
+
+def git_version():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--", CODES_DIR], cwd=BENCH_DIR).decode().strip()
+        return commit + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+def load_results(path):
+    results = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            results = [json.loads(line) for line in f if line.strip()]
+    return results
+
+
+## 同一任务、数据量与耗时配置下, 其他版本最近一次的结果
+def previous_result(results, result):
+    keys = ["job", "size", "content_length", "service_latency", "per_doc_latency", "db_latency"]
+    for old in reversed(results):
+        if all(old.get(key) == result[key] for key in keys) and old.get("version") != result["version"]:
+            return old
+    return None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="news job offline benchmark")
+    arg_parser.add_argument("--jobs", nargs="+", default=list(JOBS), choices=list(JOBS))
+    arg_parser.add_argument("--sizes", nargs="+", type=int, default=[200, 2000])
+    arg_parser.add_argument("--content-length", type=int, default=2000, help="正文字数")
+    arg_parser.add_argument("--service-latency", type=float, default=0.05, help="nlp服务每次请求的固定耗时(秒)")
+    arg_parser.add_argument("--per-doc-latency", type=float, default=0.005, help="nlp服务每篇资讯增加的耗时(秒)")
+    arg_parser.add_argument("--db-latency", type=float, default=0.001, help="数据库每次往返的耗时(秒)")
+    arg_parser.add_argument("--results", default=RESULTS_PATH)
+    arg_parser.add_argument("--no-save", action="store_true", help="只输出结果, 不写入结果文件")
+    arg_parser.add_argument("--worker", help=argparse.SUPPRESS)
+    arg_parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    version = git_version()
+    history = load_results(args.results)
+    new_results = []
+    print("{:<26}{:>8}{:>12}{:>12}{:>12}{:>14}".format("job", "size", "seconds", "docs/s", "peak MB", "vs previous"))
+
+    for job in args.jobs:
+        for size in args.sizes:
+            command = [sys.executable, os.path.abspath(__file__), "--worker", job, "--size", str(size),
+                       "--content-length", str(args.content_length), "--service-latency", str(args.service_latency),
+                       "--per-doc-latency", str(args.per_doc_latency), "--db-latency", str(args.db_latency)]
+            process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if process.returncode != 0:
+                print("{:<26}{:>8}  失败:\n{}".format(job, size, process.stderr.decode("utf-8", "replace")[-2000 : ]))
+                continue
+
+            result = {
+                "job": job,
+                "size": size,
+                "content_length": args.content_length,
+                "service_latency": args.service_latency,
+                "per_doc_latency": args.per_doc_latency,
+                "db_latency": args.db_latency,
+                "version": version,
+                "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            result.update(json.loads(process.stdout.decode("utf-8").strip().splitlines()[-1]))
+            new_results.append(result)
+
+            compare = ""
+            old = previous_result(history, result)
+            if old and old["docs_per_second"]:
+                compare = "{:+.1f}% ({})".format((result["docs_per_second"] / old["docs_per_second"] - 1) * 100, old["version"])
+            print("{:<26}{:>8}{:>12}{:>12}{:>12}{:>14}".format(job, size, result["elapsed_seconds"], result["docs_per_second"],
+                                                           result["peak_delta_mb"], compare))
+
+    if not args.no_save and new_results:
+        os.makedirs(os.path.dirname(args.results), exist_ok=True)
+        with open(args.results, "a", encoding="utf-8") as f:
+            for result in new_results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : adaptive_batch.py
+# Description  : 自适应批处理；按请求体字节数与服务耗时动态调整每批资讯数
+#******************************************************************************
+
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+## 默认按json序列化后的字节数估计请求体大小
+def payload_bytes(item):
+    return len(json.dumps(item, ensure_ascii=False).encode("utf-8"))
+
+
+class AdaptiveBatcher(object):
+
+    def __init__(self, batch_size=20, min_size=5, max_size=50, max_bytes=4 * 1024 * 1024, target_latency=30, size_fn=payload_bytes):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes                  ## 单批请求体字节数上限
+        self.target_latency = target_latency        ## 单批期望耗时(秒)
+        self.size_fn = size_fn
+        self.batch_size = float(min(max(batch_size, min_size), max_size))
+        self.lock = threading.Lock()                ## 并发调用时多个线程同时反馈耗时
+
+
+    def current_size(self):
+        with self.lock:
+            return int(self.batch_size)
+
+
+    ## 调用成功后反馈耗时: 按 耗时与资讯数成正比 估算目标批大小, 与当前值平滑
+    def observe(self, count, latency):
+        if count <= 0:
+            return
+        with self.lock:
+            ideal = count * self.target_latency / max(latency, 0.001)
+            size = 0.5 * self.batch_size + 0.5 * ideal
+            self.batch_size = min(max(size, self.min_size), self.max_size)
+
+
+    ## 调用失败后批大小减半
+    def observe_failure(self):
+        with self.lock:
+            self.batch_size = max(self.batch_size / 2, self.min_size)
+            logger.info("服务调用失败, 批大小调整为: {}".format(int(self.batch_size)))
+
+
+    ## 将items分批, 每批资讯数不超过当前批大小, 字节数不超过max_bytes(单篇超过上限时单独成批)
+    def batches(self, items):
+        batch = []
+        batch_bytes = 0
+        for item in items:
+            item_bytes = self.size_fn(item)
+            if batch and (len(batch) >= self.current_size() or batch_bytes + item_bytes > self.max_bytes):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(item)
+            batch_bytes += item_bytes
+
+        if batch:
+            yield batch
@@ -0,0 +1,90 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : arango_bulk.py
+# Description  : arangodb批量写入；缓存文档，按块调用import接口写入，同_key覆盖
+#******************************************************************************
+
+import re
+import time
+import logging
+from pyArango.theExceptions import UpdateError
+
+logger = logging.getLogger(__name__)
+
+## import接口details中出错文档的_key
+ERROR_KEY_PATTERN = re.compile(r'offending document: \{.*?"_key"\s*:\s*"([^"]+)"')
+
+
+class ArangoBulkWriter(object):
+
+    def __init__(self, arango_db, collection_name, chunk_size=500, on_duplicate="replace", wait_for_sync=False, on_error=None, metrics=None):
+        self.arango_db = arango_db
+        self.collection = arango_db[collection_name]
+        self.collection_name = collection_name
+        self.chunk_size = chunk_size
+        self.on_duplicate = on_duplicate        ## 同_key文档的处理方式: replace覆盖, error报错
+        self.wait_for_sync = wait_for_sync      ## 每次flush落盘一次, 而不是每篇文档落盘
+        self.on_error = on_error                ## 单篇文档写入失败的回调, 参数为 (_key, 错误信息)
+        self.metrics = metrics                  ## JobMetrics, 记录write阶段
+
+        self.docs = []                  ## 待写入的文档
+        self.remove_keys = []           ## 待删除的_key
+        self.saved_count = 0            ## 写入成功的文档数
+        self.failed_count = 0           ## 写入失败的文档数
+
+
+    def add(self, doc):
+        self.docs.append(doc)
+        if len(self.docs) >= self.chunk_size:
+            self.flush()
+
+
+    ## 删除同_key的旧文档, 用于新数据不再入库时的同id覆盖
+    def remove(self, key):
+        self.remove_keys.append(key)
+        if len(self.remove_keys) >= self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        if self.remove_keys:
+            keys, self.remove_keys = self.remove_keys, []
+            aql = "FOR key IN @keys REMOVE key IN @@collection OPTIONS { ignoreErrors: true }"
+            try:
+                self.arango_db.AQLQuery(aql, bindVars={"keys": keys, "@collection": self.collection_name})
+            except Exception as e:
+                logger.error("批量删除arangodb文档出错: {}".format(str(e)))
+
+        if not self.docs:
+            return
+        docs, self.docs = self.docs, []
+
+        params = {"details": "true"}
+        if self.wait_for_sync:
+            params["waitForSync"] = "true"
+
+        failures = []                   ## (_key, 错误信息)
+        start_time = time.time()
+        try:
+            self.collection.bulkSave(docs, onDuplicate=self.on_duplicate, **params)
+        except UpdateError as e:
+            details = e.errors.get("details", []) if isinstance(e.errors, dict) else []
+            for detail in details:
+                match = ERROR_KEY_PATTERN.search(detail)
+                failures.append((match.group(1) if match else None, detail))
+            if not failures:
+                failures = [(doc.get("_key"), str(e)) for doc in docs]
+        except Exception as e:
+            failures = [(doc.get("_key"), str(e)) for doc in docs]
+
+        if self.metrics:
+            self.metrics.record("write", time.time() - start_time, len(docs))
+
+        for key, error in failures:
+            logger.error("插入arangodb出错, 文档id: {}, 原因: {}".format(key, error))
+            if self.on_error:
+                self.on_error(key, error)
+
+        self.failed_count += len(failures)
+        self.saved_count += len(docs) - len(failures)
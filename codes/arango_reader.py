@@ -0,0 +1,69 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : arango_reader.py
+# Description  : arangodb增量读取；按update_time区间 [start, end) 流式读取文档, 使用绑定变量,
+#                游标分批拉取, 只返回调用方需要的字段
+#******************************************************************************
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+## 游标每次拉取的文档数
+READ_BATCH_SIZE = 1000
+
+## 游标空闲超时(秒), 每次拉取后重新计时; 服务端默认30秒, 调用方处理一批文档的时间可能更长
+READ_CURSOR_TTL = 1800
+
+
+## 按update_time区间流式读取, 内存占用与当天数据量无关
+## fields为需要的字段(KEEP投影), 为空时返回整篇文档; 首次创建时确保update_time上有持久化索引
+class ArangoUpdateReader(object):
+
+    def __init__(self, arango_db, collection_name, fields=None, batch_size=READ_BATCH_SIZE, ensure_index=True, ttl=READ_CURSOR_TTL):
+        self.arango_db = arango_db
+        self.collection_name = collection_name
+        self.fields = ["_key"] + [field for field in fields if field != "_key"] if fields else None
+        self.batch_size = batch_size
+        self.ttl = ttl                  ## 游标空闲超时, 应大于调用方处理一批文档的最长时间
+        self.count = 0                  ## 已读取的文档数
+
+        if ensure_index:
+            self.ensure_index()
+
+
+    ## update_time上的持久化索引, 已存在时arangodb直接返回
+    def ensure_index(self):
+        try:
+            self.arango_db[self.collection_name].ensurePersistentIndex(["update_time"], unique=False, sparse=False)
+        except Exception as e:
+            logger.error("创建 {} update_time索引出错: {}".format(self.collection_name, str(e)))
+
+
+    ## 读取update_time在 [start, end) 内的文档; after_key不为None时按_key排序, 只读取_key大于after_key的文档, 用于断点续跑
+    def read(self, start, end, after_key=None):
+        bind_vars = {"@collection": self.collection_name, "start": start, "end": end}
+        aql_filter = "x.update_time >= @start AND x.update_time < @end"
+        aql_sort = ""
+        if after_key is not None:
+            aql_filter += " AND x._key > @after_key"
+            aql_sort = "SORT x._key"
+            bind_vars["after_key"] = after_key
+        aql_return = "x"
+        if self.fields:
+            aql_return = "KEEP(x, @fields)"
+            bind_vars["fields"] = self.fields
+
+        aql = "FOR x IN @@collection FILTER {} {} RETURN {}".format(aql_filter, aql_sort, aql_return)
+        try:
+            query = self.arango_db.AQLQuery(aql, bindVars=bind_vars, batchSize=self.batch_size, rawResults=True,
+                                            options={"stream": True}, ttl=self.ttl)
+        except Exception as e:
+            ## 查询失败时任务失败, 不能按没有数据正常结束
+            logger.error("查询arangodb错误: " + str(e))
+            raise
+
+        for result in query:
+            self.count += 1
+            yield result
@@ -0,0 +1,177 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : concept_cache.py
+# Description  : mysql概念对应表的本地快照；第一次使用时加载, 有本地快照时不查询mysql,
+#                快照过期后继续使用旧快照, 后台线程比较版本(行数与校验和), 有变化时重新加载
+#******************************************************************************
+
+import os
+import json
+import time
+import logging
+import threading
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+## 快照文件目录
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache")
+
+## 快照有效期(秒)
+SNAPSHOT_TTL = 6 * 3600
+
+
+## mysql表中 key_column -> value_column 的对应表, 用法与dict相同(in、[]、get)
+## 只查询两列; 列可以是列名, 也可以是 select * 结果中的位置, 第一次查询mysql时解析为列名
+## 没有本地快照时同步查询mysql, 仍加载不到时抛出异常
+class ConceptSnapshot(object):
+
+    def __init__(self, name, connect_params, table, key_column, value_column, where=None, ttl=SNAPSHOT_TTL, cache_dir=None):
+        self.name = name
+        self.connect_params = connect_params
+        self.table = table
+        self.key_column = key_column
+        self.value_column = value_column
+        self.where = where or {}            ## 字段 -> 值, 条件之间为AND
+        self.ttl = ttl
+        self.path = os.path.join(cache_dir or CACHE_DIR, "concept_{}.json".format(name))
+
+        self.snapshot = None                ## {"version", "load_time", "mapping"}, None表示尚未加载
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+        self.miss_refreshed = False         ## 本次运行是否已因key缺失同步刷新过
+
+
+    ## 快照中没有的key(如mysql中新添加的数据源), 本次运行第一次遇到时同步刷新一次快照再判断
+    def __contains__(self, key):
+        if key in self.mapping:
+            return True
+        with self.lock:
+            if not self.miss_refreshed:
+                self.miss_refreshed = True
+                logger.info("概念对应表 {} 快照中没有 [{}], 同步刷新快照".format(self.name, key))
+                snapshot = self.refresh(self.snapshot)
+                if snapshot is not None:
+                    self.snapshot = snapshot
+        return key in self.mapping
+
+    def __getitem__(self, key):
+        return self.mapping[key]
+
+    def get(self, key, default=None):
+        return self.mapping.get(key, default)
+
+
+    ## 当前对应表, 第一次访问时加载; 快照过期时启动后台刷新, 本次仍返回旧快照
+    @property
+    def mapping(self):
+        with self.lock:
+            if self.snapshot is None:
+                snapshot = self.read_file()
+                if snapshot is None or not snapshot["mapping"]:
+                    snapshot = self.refresh()
+                ## 没有本地快照且mysql不可用(或列名配置错误)时直接报错, 由azkaban重试, 不能按空表跳过全部资讯
+                if snapshot is None:
+                    raise Exception("概念对应表 {} 加载失败: 没有本地快照, 且无法从mysql加载".format(self.name))
+                self.snapshot = snapshot
+            elif time.time() - self.snapshot["load_time"] > self.ttl and self.refresh_thread is None:
+                self.refresh_thread = threading.Thread(target=self.background_refresh, name="concept-" + self.name, daemon=True)
+                self.refresh_thread.start()
+            return self.snapshot["mapping"]
+
+
+    def read_file(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.error("概念对应表快照读取失败: {}, 原因: {}".format(self.path, str(e)))
+            return None
+        logger.info("概念对应表 {} 从本地快照加载 {} 条".format(self.name, len(snapshot["mapping"])))
+        return snapshot
+
+
+    ## 先写临时文件再替换, 与断点文件的写法一致
+    def write_file(self, snapshot):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+    ## 按位置配置的列, 用 LIMIT 0 的 select * 从cursor.description取得列名, 只解析一次
+    def resolve_columns(self, cursor):
+        if not isinstance(self.key_column, int) and not isinstance(self.value_column, int):
+            return
+        cursor.execute("SELECT * FROM `{}` LIMIT 0".format(self.table))
+        names = [column[0] for column in cursor.description]
+        if isinstance(self.key_column, int):
+            self.key_column = names[self.key_column]
+        if isinstance(self.value_column, int):
+            self.value_column = names[self.value_column]
+        logger.info("概念对应表 {} 使用列: {} -> {}".format(self.name, self.key_column, self.value_column))
+
+
+    def where_clause(self):
+        if not self.where:
+            return "", ()
+        return " WHERE " + " AND ".join("`{}`=%s".format(column) for column in self.where), tuple(self.where.values())
+
+
+    ## 版本: 行数与两列拼接后crc32的异或, 表很小, 不需要读取全部数据行即可判断是否变化
+    def query_version(self, cursor):
+        where, args = self.where_clause()
+        cursor.execute("SELECT COUNT(*), COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', `{}`, `{}`))), 0) FROM `{}`{}"
+                       .format(self.key_column, self.value_column, self.table, where), args)
+        return [int(value) for value in cursor.fetchall()[0]]
+
+
+    def query_mapping(self, cursor):
+        where, args = self.where_clause()
+        cursor.execute("SELECT `{}`, `{}` FROM `{}`{}".format(self.key_column, self.value_column, self.table, where), args)
+        return dict((key, value) for key, value in cursor.fetchall())
+
+
+    ## 从mysql刷新快照并写入文件, 版本未变时只更新加载时间; 失败或查询结果为空时返回None, 不覆盖已有快照
+    def refresh(self, snapshot=None):
+        try:
+            connector = pymysql.connect(**self.connect_params)
+            try:
+                with connector.cursor() as cursor:
+                    self.resolve_columns(cursor)
+                    version = self.query_version(cursor)
+                    if snapshot is not None and snapshot["version"] == version:
+                        mapping = snapshot["mapping"]
+                    else:
+                        mapping = self.query_mapping(cursor)
+                        logger.info("概念对应表 {} 从mysql加载 {} 条".format(self.name, len(mapping)))
+                        if not mapping:
+                            raise Exception("查询结果为空")
+            finally:
+                connector.close()
+        except Exception as e:
+            logger.error("概念对应表 {} 从mysql加载失败, 原因: {}".format(self.name, str(e)))
+            return None
+
+        snapshot = {"version": version, "load_time": time.time(), "mapping": mapping}
+        try:
+            self.write_file(snapshot)
+        except Exception as e:
+            logger.error("概念对应表快照写入失败: {}, 原因: {}".format(self.path, str(e)))
+        return snapshot
+
+
+    def background_refresh(self):
+        snapshot = self.refresh(self.snapshot)
+        if snapshot is not None:
+            self.snapshot = snapshot
+
+
+    ## 等待后台刷新完成, 保证新快照已写入文件
+    def wait(self):
+        if self.refresh_thread is not None:
+            self.refresh_thread.join()
@@ -1,4 +1,5 @@
 from elasticsearch import Elasticsearch
+from job_metrics import JobMetrics
 
 ## ES新闻库
 
@@ -102,4 +103,7 @@ mappings = {
     }  
 }
 
-res = es.indices.create(index=ES_INDEX, body=mappings)
+metrics = JobMetrics("create_industry_center_news_es")
+with metrics.stage("write"):
+    res = es.indices.create(index=ES_INDEX, body=mappings)
+metrics.write()
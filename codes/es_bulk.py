@@ -0,0 +1,149 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : es_bulk.py
+# Description  : es批量导入；资讯按块用msearch查重, 不重复的以index操作(按_id覆盖)交给parallel_bulk
+#                多线程批量写入, 逐条记录写入失败的资讯
+#******************************************************************************
+
+import time
+import logging
+from elasticsearch import helpers
+
+logger = logging.getLogger(__name__)
+
+## 每个bulk请求的资讯数与字节数上限, 写入线程数
+ES_CHUNK_SIZE = 500
+ES_MAX_CHUNK_BYTES = 20 * 1024 * 1024
+ES_THREAD_COUNT = 4
+
+## 标题相似度高于该分数视为重复资讯
+DEDUP_SCORE = 2.0
+
+## 写入失败时日志中最多列出的资讯数
+MAX_LOGGED_FAILURES = 100
+
+
+## parallel_bulk只用到client.bulk与client.transport, 包一层记录每个bulk请求的耗时、条数与字节数
+class TimedBulkClient(object):
+
+    def __init__(self, es, metrics):
+        self.es = es
+        self.transport = es.transport   ## parallel_bulk用transport.serializer序列化操作
+        self.metrics = metrics
+
+
+    def bulk(self, body, *args, **kwargs):
+        start_time = time.time()
+        try:
+            return self.es.bulk(body, *args, **kwargs)
+        finally:
+            ## index操作每条资讯两行: 操作行与文档行
+            self.metrics.record("write", time.time() - start_time, body.count("\n") // 2, len(body.encode("utf-8")))
+
+
+## index(docs)导入 (_id, 资讯) 序列, 返回写入成功的条数
+## 查重只排除与索引中其他_id的资讯标题相似的资讯, 同_id的旧资讯直接被覆盖, 不需要先删除
+class EsBulkIndexer(object):
+
+    def __init__(self, es, index, doc_type, chunk_size=ES_CHUNK_SIZE, max_chunk_bytes=ES_MAX_CHUNK_BYTES,
+                 thread_count=ES_THREAD_COUNT, dedup_score=DEDUP_SCORE, metrics=None):
+        self.es = es
+        self.index_name = index
+        self.doc_type = doc_type
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.thread_count = thread_count
+        self.dedup_score = dedup_score
+        self.metrics = metrics
+
+        self.titles = set()             ## 本次已提交的标题, 批量写入未refresh前查询不到
+        self.duplicate_count = 0        ## 重复资讯数
+        self.saved_count = 0            ## 写入成功数
+        self.failed_count = 0           ## 写入失败数
+
+
+    def dedup_query(self, _id, title):
+        return {
+            "size": 1,
+            "_source": False,
+            "query": {
+                "bool": {
+                    "must": {"match": {"title": title}},
+                    "must_not": {"ids": {"values": [_id]}}
+                }
+            }
+        }
+
+
+    ## 一块资讯一次msearch查重, 返回不重复的资讯
+    def dedup(self, docs):
+        start_time = time.time()
+        body = []
+        for _id, doc in docs:
+            body.append({"index": self.index_name})
+            body.append(self.dedup_query(_id, doc["title"]))
+        try:
+            responses = self.es.msearch(body=body)["responses"]
+        except Exception as e:
+            ## 查重失败时不过滤, 与按_id覆盖写入一起不会产生重复的_id
+            logger.error("es查重出错, 本块 {} 条不查重, 原因: {}".format(len(docs), str(e)))
+            responses = [{} for _ in docs]
+
+        unique_docs = []
+        for (_id, doc), response in zip(docs, responses):
+            if "error" in response:
+                logger.error("es查重出错, id: {}, 原因: {}".format(_id, response["error"]))
+            score = (response.get("hits") or {}).get("max_score")
+            if (score and score > self.dedup_score) or doc["title"] in self.titles:
+                logger.info("发现类似资讯")
+                self.duplicate_count += 1
+                continue
+            self.titles.add(doc["title"])
+            unique_docs.append((_id, doc))
+
+        if self.metrics:
+            self.metrics.record("dedup", time.time() - start_time, len(docs))
+        return unique_docs
+
+
+    ## 按块查重后生成bulk的index操作
+    def actions(self, docs):
+        chunk = []
+        for item in docs:
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                yield from self.chunk_actions(chunk)
+                chunk = []
+        if chunk:
+            yield from self.chunk_actions(chunk)
+
+
+    def chunk_actions(self, chunk):
+        for _id, doc in self.dedup(chunk):
+            yield {"_op_type": "index", "_index": self.index_name, "_type": self.doc_type, "_id": _id, "_source": doc}
+
+
+    def index(self, docs):
+        client = TimedBulkClient(self.es, self.metrics) if self.metrics else self.es
+        results = helpers.parallel_bulk(client, self.actions(docs), thread_count=self.thread_count, chunk_size=self.chunk_size,
+                                        max_chunk_bytes=self.max_chunk_bytes, raise_on_error=False, raise_on_exception=False,
+                                        request_timeout=30)
+        for success, item in results:
+            if success:
+                self.saved_count += 1
+                continue
+            self.failed_count += 1
+            if self.failed_count <= MAX_LOGGED_FAILURES:
+                result = item.get("index", item)
+                logger.error("写入es失败, id: {}, 状态: {}, 原因: {}".format(result.get("_id"), result.get("status"), result.get("error")))
+
+        ## 批量写入后refresh一次, 下游任务可以立即查询到本次导入的资讯
+        try:
+            self.es.indices.refresh(index=self.index_name)
+        except Exception as e:
+            logger.error("refresh es索引出错: " + str(e))
+
+        if self.failed_count:
+            logger.error("写入es失败共 {} 条".format(self.failed_count))
+        return self.saved_count
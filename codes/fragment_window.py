@@ -0,0 +1,304 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : fragment_window.py
+# Description  : kb_news_fragment事件句去重窗口；事件句指纹(分词与实体名的哈希id)随事件句入库,
+#                去重时用numpy一次计算新事件句与整个窗口的重合度; 分词由进程池批量完成
+#******************************************************************************
+
+import zlib
+import logging
+import datetime
+import multiprocessing
+from collections import OrderedDict
+import numpy as np
+import jieba
+
+logger = logging.getLogger(__name__)
+
+## 相似性阈值, news_fragment_pipeline去重共用该配置
+TEXT_THRESHOLD = 0.8
+ENTITY_THRESHOLD = 0.8
+
+## 分词进程数, 为1时在主进程分词; news_fragment_pipeline共用该配置
+TOKENIZE_PROCESSES = 8
+
+## 句子数少于该值时直接在主进程分词, 省去进程间传输
+TOKENIZE_MIN_PARALLEL = 32
+
+## 分词结果缓存的句子数
+TOKENIZE_CACHE_SIZE = 200000
+
+
+## 词或实体名的哈希id, crc32为32位整数, 存入arangodb(双精度数)不丢失精度, 且与进程无关
+def hash_ids(words):
+    return sorted(set(zlib.crc32(word.encode("utf-8")) for word in words))
+
+
+## 句子的分词哈希id
+def token_ids(section):
+    return hash_ids(jieba.cut(section or ""))
+
+
+## 事件句指纹: 分词哈希id与实体名哈希id, tokens为已算好的分词哈希id
+def fingerprint(section, entity_names, tokens=None):
+    return {
+        "tokens": token_ids(section) if tokens is None else tokens,
+        "entities": hash_ids([name or "" for name in entity_names])
+    }
+
+
+## 两个集合的重合度, 与 len(set_1 & set_2) / min(len(set_1), len(set_2)) 一致
+def overlap(counts, sizes, size):
+    min_sizes = np.minimum(sizes, size)
+    scores = np.zeros(len(sizes))
+    np.divide(counts, min_sizes, out=scores, where=min_sizes > 0)
+    return scores
+
+
+## 按容量倍增追加的numpy数组
+class GrowableArray(object):
+
+    def __init__(self, dtype=np.int64, capacity=16):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+
+    def append(self, value):
+        if self.size == len(self.data):
+            data = np.empty(len(self.data) * 2, dtype=self.data.dtype)
+            data[ : self.size] = self.data
+            self.data = data
+        self.data[self.size] = value
+        self.size += 1
+
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+
+    @property
+    def values(self):
+        return self.data[ : self.size]
+
+
+## Tokenizer.submit的返回结果, get()等待子进程分词完成并写入缓存
+class TokenizeResult(object):
+
+    def __init__(self, tokenizer, sentences, misses, async_result):
+        self.tokenizer = tokenizer
+        self.sentences = sentences
+        self.misses = misses
+        self.async_result = async_result
+
+
+    def get(self):
+        if self.async_result is not None:
+            self.tokenizer.update(zip(self.misses, self.async_result.get()))
+            self.async_result = None
+        return [self.tokenizer.lookup(sentence) for sentence in self.sentences]
+
+
+## 多进程分词, 按句子缓存分词哈希id
+## 批量提交句子, 缓存中没有的句子交给进程池分词, 主进程可以同时处理其他批次
+class Tokenizer(object):
+
+    def __init__(self, processes=TOKENIZE_PROCESSES, cache_size=TOKENIZE_CACHE_SIZE, min_parallel=TOKENIZE_MIN_PARALLEL):
+        processes = min(processes, multiprocessing.cpu_count())
+        self.processes = processes
+        self.cache_size = cache_size
+        self.min_parallel = min_parallel
+        self.cache = OrderedDict()      ## 句子 -> 分词哈希id, 按最近使用排序
+        self.hit_count = 0
+        self.miss_count = 0
+        self.pool = None
+        if processes > 1:
+            ## 先在主进程加载jieba词典, fork出的子进程直接共用, 不再各自加载
+            jieba.initialize()
+            self.pool = multiprocessing.Pool(processes, initializer=jieba.initialize)
+
+
+    def lookup(self, sentence):
+        tokens = self.cache.get(sentence)
+        if tokens is None:
+            tokens = token_ids(sentence)
+            self.update([(sentence, tokens)])
+        else:
+            self.cache.move_to_end(sentence)
+        return tokens
+
+
+    def update(self, items):
+        for sentence, tokens in items:
+            self.cache[sentence] = tokens
+            self.cache.move_to_end(sentence)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+
+    ## 提交一批句子分词, 返回TokenizeResult
+    def submit(self, sentences):
+        sentences = [sentence or "" for sentence in sentences]
+        misses = list(OrderedDict.fromkeys(sentence for sentence in sentences if sentence not in self.cache))
+        self.miss_count += len(misses)
+        self.hit_count += len(sentences) - len(misses)
+
+        async_result = None
+        if self.pool is not None and len(misses) >= self.min_parallel:
+            chunk_size = max(1, len(misses) // (self.processes * 4))
+            async_result = self.pool.map_async(token_ids, misses, chunksize=chunk_size)
+        return TokenizeResult(self, sentences, misses, async_result)
+
+
+    ## 一批句子分词, 返回与sentences对应的分词哈希id
+    def tokenize(self, sentences):
+        return self.submit(sentences).get()
+
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        logger.info("分词缓存命中 {} 句, 未命中 {} 句".format(self.hit_count, self.miss_count))
+
+
+## kb_news_fragment近期事件句的去重窗口, 每次运行按需加载一次
+## 每条事件句保存发布日期、事件类型与指纹; 分词id与 (事件类型, 实体id) 分别建倒排表,
+## 文本重合度对整个窗口一次算出, 实体重合度只计算倒排表中的候选事件句
+class FragmentWindow(object):
+
+    def __init__(self, arango_db, collection_name, text_threshold=TEXT_THRESHOLD, entity_threshold=ENTITY_THRESHOLD, before_load=None, tokenizer=None):
+        self.arango_db = arango_db
+        self.collection_name = collection_name
+        self.tokenizer = tokenizer or Tokenizer(processes=1)
+        self.text_threshold = text_threshold
+        self.entity_threshold = entity_threshold
+        self.before_load = before_load                  ## 从库中加载前的回调, 用于先写入缓存中尚未入库的事件句
+        self.since = None                               ## 已加载的最早发布日期, None表示尚未加载
+
+        self.sections = []                              ## 序号 -> 事件句
+        self.event_types = {}                           ## 事件类型 -> 编号
+        self.dates = GrowableArray(np.int32)            ## 序号 -> 发布日期(ordinal)
+        self.event_codes = GrowableArray(np.int32)      ## 序号 -> 事件类型编号
+        self.token_sizes = GrowableArray(np.int32)      ## 序号 -> 分词数
+        self.token_postings = {}                        ## 分词id -> 包含该词的事件句序号
+        self.entity_sizes = GrowableArray(np.int32)     ## 序号 -> 实体数
+        self.entity_postings = {}                       ## (事件类型编号, 实体id) -> 该事件类型且包含该实体的事件句序号
+        self.keys = {}                                  ## _key -> 序号, 只记录本次运行插入的事件句, 用于入库失败时移除
+
+
+    ## 保证发布时间不早于since的事件句都已加载, 已加载过的日期范围不再重复查询
+    def load(self, since):
+        if self.since is not None and since >= self.since:
+            return
+
+        aql_filter = "x.publish_time >= @since"
+        bind_vars = {"@collection": self.collection_name, "since": since}
+        if self.since is not None:
+            aql_filter += " AND x.publish_time < @until"
+            bind_vars["until"] = self.since
+        aql = """FOR x IN @@collection
+                    FILTER {}
+                    RETURN {{section: x.section, event_type: x.event_type, entity_names: x.entities[*].name,
+                            publish_time: x.publish_time, fingerprint: x.fingerprint}}""".format(aql_filter)
+        if self.before_load:
+            self.before_load()
+        try:
+            query = self.arango_db.AQLQuery(aql, bindVars=bind_vars, batchSize=1000, rawResults=True)
+            results = list(query)
+        except Exception as e:
+            logger.error("加载去重事件句出错, 发布时间 >= {}, 原因: {}".format(since, str(e)))
+            return
+
+        ## 早期入库的事件句没有指纹, 加载时批量分词计算
+        unfingerprinted = [result for result in results if not result["fingerprint"]]
+        tokens_list = self.tokenizer.tokenize([result["section"] for result in unfingerprinted])
+        for result, tokens in zip(unfingerprinted, tokens_list):
+            result["fingerprint"] = fingerprint(result["section"], result["entity_names"] or [], tokens)
+
+        for result in results:
+            self.add(result["section"], result["event_type"], result["publish_time"], result["fingerprint"])
+
+        self.since = since
+        logger.info("去重窗口加载发布时间 >= {} 的事件句 {} 条, 其中计算指纹 {} 条".format(since, len(results), len(unfingerprinted)))
+
+
+    def add(self, section, event_type, publish_time, fingerprint, key=None):
+        if not publish_time:
+            return
+        index = len(self.sections)
+        if key is not None:
+            self.keys[key] = index
+        self.sections.append(section)
+        self.dates.append(datetime.datetime.strptime(publish_time[ : 10], "%Y-%m-%d").toordinal())
+        event_code = self.event_types.setdefault(event_type, len(self.event_types))
+        self.event_codes.append(event_code)
+
+        tokens = fingerprint["tokens"]
+        self.token_sizes.append(len(tokens))
+        for token in tokens:
+            if token not in self.token_postings:
+                self.token_postings[token] = GrowableArray(np.int32, 4)
+            self.token_postings[token].append(index)
+
+        entities = fingerprint["entities"]
+        self.entity_sizes.append(len(entities))
+        for entity in entities:
+            if (event_code, entity) not in self.entity_postings:
+                self.entity_postings[(event_code, entity)] = GrowableArray(np.int32, 4)
+            self.entity_postings[(event_code, entity)].append(index)
+
+
+    ## 新事件句入库时同步更新窗口; 早于已加载范围的不需要加入, 扩展窗口前会先入库, 再从库中读到
+    def insert(self, doc):
+        if self.since is None or doc["publish_time"] < self.since:
+            return
+        self.add(doc["section"], doc["event_type"], doc["publish_time"], doc["fingerprint"], doc.get("_key"))
+
+
+    ## 事件句入库失败时从窗口移除, 避免把之后真正的事件句当作未入库事件句的重复过滤掉
+    ## 倒排表不变, 发布日期置为0, 任何检查日期下都不会再命中
+    def remove(self, key):
+        index = self.keys.pop(key, None)
+        if index is not None:
+            self.dates.data[index] = 0
+
+
+    ## 查找发布时间不早于check_date的相似事件句, 返回 (库内事件句, 相似类型), 不重复返回None
+    def find_duplicate(self, fingerprint, event_type, check_date):
+        self.load(check_date)
+        count = len(self.sections)
+        if not count:
+            return None
+
+        check_ordinal = datetime.datetime.strptime(check_date, "%Y-%m-%d").toordinal()
+
+        ## 文本相似性: 从倒排表统计每条事件句与新事件句的相同分词数
+        tokens = fingerprint["tokens"]
+        postings = [self.token_postings[token].values for token in tokens if token in self.token_postings]
+        token_counts = np.bincount(np.concatenate(postings), minlength=count) if postings else np.zeros(count)
+        text_duplicate = (self.dates.values >= check_ordinal) & \
+                         (overlap(token_counts, self.token_sizes.values, len(tokens)) > self.text_threshold)
+        text_index = int(np.argmax(text_duplicate)) if text_duplicate.any() else count
+
+        ## 事件类型与实体相似性: 只比较同事件类型且至少有一个相同实体的事件句
+        entity_index = count
+        event_code = self.event_types.get(event_type)
+        entities = fingerprint["entities"]
+        postings = [self.entity_postings[(event_code, entity)].values for entity in entities
+                    if (event_code, entity) in self.entity_postings]
+        if postings:
+            candidates, entity_counts = np.unique(np.concatenate(postings), return_counts=True)
+            entity_duplicate = (self.dates.values[candidates] >= check_ordinal) & \
+                               (overlap(entity_counts, self.entity_sizes.values[candidates], len(entities)) > self.entity_threshold)
+            if entity_duplicate.any():
+                entity_index = int(candidates[np.argmax(entity_duplicate)])
+
+        ## 与逐条比较时一致, 返回最早加入窗口的相似事件句, 同一条两种都相似时记为文本相似
+        if text_index == count and entity_index == count:
+            return None
+        if text_index <= entity_index:
+            return self.sections[text_index], "文本"
+        return self.sections[entity_index], "实体"
@@ -0,0 +1,112 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : hbase_codec.py
+# Description  : hbase大字段压缩；raw:html、info:content等大字段写入前压缩,
+#                压缩方式写入同列族的 <列名>_codec 列, 读取时按该列自动解压
+#******************************************************************************
+
+import zlib
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+## 需要压缩的列
+COMPRESS_COLUMNS = [b"raw:html", b"info:content"]
+
+## 小于该字节数的值不压缩
+COMPRESS_MIN_SIZE = 1024
+
+## 压缩方式: zlib 或 zstd(需安装zstandard), 压缩级别; html重复度高, 低级别压缩率已接近高级别, 耗时约一半
+COMPRESS_CODEC = "zlib"
+COMPRESS_LEVEL = 1
+
+## 标记压缩方式的列名后缀; 未压缩的值标记为raw
+CODEC_SUFFIX = b"_codec"
+RAW_CODEC = "raw"
+
+
+def codec_column(column):
+    return column + CODEC_SUFFIX
+
+
+def compress(value, codec=COMPRESS_CODEC, level=COMPRESS_LEVEL):
+    if codec == "zlib":
+        return zlib.compress(value, level)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(value)
+    raise ValueError("不支持的压缩方式: {}".format(codec))
+
+
+def decompress(value, codec):
+    if not codec or codec == RAW_CODEC:
+        return value
+    if codec == "zlib":
+        return zlib.decompress(value)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(value)
+    raise ValueError("不支持的压缩方式: {}".format(codec))
+
+
+## 读取hbase行时使用: 按 <列名>_codec 解压对应的列, 并去掉标记列; 没有标记或标记为raw的列原样返回
+def decode_row(data):
+    row = {}
+    for column, value in data.items():
+        if column.endswith(CODEC_SUFFIX):
+            continue
+        codec = data.get(codec_column(column))
+        row[column] = decompress(value, codec.decode("utf-8") if codec else None)
+    return row
+
+
+## 写入前压缩指定列, 压缩后不比原值小时保留原值并标记为raw; 统计压缩前后字节数与压缩耗时
+class HBaseCodec(object):
+
+    def __init__(self, columns=COMPRESS_COLUMNS, codec=COMPRESS_CODEC, level=COMPRESS_LEVEL, min_size=COMPRESS_MIN_SIZE):
+        self.columns = columns
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+        self.raw_bytes = 0              ## 压缩列原始字节数
+        self.stored_bytes = 0           ## 压缩列实际写入字节数
+        self.seconds = 0.0              ## 累计压缩耗时
+
+
+    def encode_row(self, data):
+        start_time = time.time()
+        for column in self.columns:
+            value = data.get(column)
+            if value is None:
+                continue
+            self.raw_bytes += len(value)
+            ## 每次都写入标记列: hbase按单元格覆盖, 同rowkey重写为未压缩值时需要覆盖旧的压缩标记
+            codec = RAW_CODEC
+            if len(value) >= self.min_size:
+                compressed = compress(value, self.codec, self.level)
+                if len(compressed) < len(value):
+                    data[column] = compressed
+                    codec = self.codec
+                    value = compressed
+            data[codec_column(column)] = codec.encode("utf-8")
+            self.stored_bytes += len(value)
+        self.seconds += time.time() - start_time
+        return data
+
+
+    ## 压缩率(写入字节数 / 原始字节数)
+    @property
+    def ratio(self):
+        return self.stored_bytes / self.raw_bytes if self.raw_bytes else 1.0
+
+
+    ## 按实际写入速度估算少发送的字节节省的写入时间, 扣除压缩耗时; 返回 (压缩率, 节省字节数, 节省秒数)
+    def report(self, bytes_per_second):
+        saved_bytes = self.raw_bytes - self.stored_bytes
+        saved_seconds = saved_bytes / bytes_per_second - self.seconds if bytes_per_second else 0.0
+        logger.info("hbase压缩({}): 压缩列原始 {} MB, 写入 {} MB, 压缩率 {}, 压缩耗时 {} 秒, 估计节省写入时间 {} 秒".format(
+            self.codec, round(self.raw_bytes / 1024 / 1024, 1), round(self.stored_bytes / 1024 / 1024, 1),
+            round(self.ratio, 3), round(self.seconds, 1), round(saved_seconds, 1)))
+        return self.ratio, saved_bytes, saved_seconds
@@ -0,0 +1,176 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : hbase_rowkey.py
+# Description  : 资讯hbase表rowkey；可选加盐 <盐值>|concept_id|create_date|_key, 盐值由_key哈希得到,
+#                同一数据源同一天的资讯分散到各region; 按盐值预分区建表, 按前缀扫描时并行扫描各个盐值分桶
+#                建表: python3 hbase_rowkey.py create_table <表名> <分桶数> | hbase shell -n
+#******************************************************************************
+
+import sys
+import zlib
+import datetime
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+## 盐值分桶数, 0表示不加盐(原rowkey格式); news_arango2hbase写入与news_hbase_reader读取共用该配置
+## 修改分桶数需要新建表并重新同步
+SALT_BUCKETS = 0
+
+## 资讯表列族
+COLUMN_FAMILIES = ["raw", "info"]
+
+## 扫描时每次从region server拉取的行数, 资讯行含html, 不宜过大
+SCAN_BATCH_SIZE = 200
+
+## 并行扫描结果队列长度, 消费慢时扫描线程等待
+SCAN_QUEUE_SIZE = 1000
+
+
+## _key对应的盐值, 固定两位十六进制, 分桶数不超过256
+def salt(key, buckets=SALT_BUCKETS):
+    return "{:02x}".format(zlib.crc32(key.encode("utf-8")) % buckets)
+
+
+## 全部盐值前缀, 不加盐时为 [""]
+def salt_prefixes(buckets=SALT_BUCKETS):
+    if not buckets:
+        return [""]
+    return ["{:02x}|".format(bucket) for bucket in range(buckets)]
+
+
+def build_rowkey(concept_id, create_date, key, buckets=SALT_BUCKETS):
+    rowkey = concept_id + "|" + create_date + "|" + key
+    if buckets:
+        rowkey = salt(key, buckets) + "|" + rowkey
+    return bytes(rowkey, encoding="utf-8")
+
+
+## 去掉盐值, 返回 (concept_id, create_date, _key)
+def parse_rowkey(rowkey, buckets=SALT_BUCKETS):
+    rowkey = rowkey.decode("utf-8")
+    if buckets:
+        rowkey = rowkey.split("|", 1)[1]
+    concept_id, create_date, key = rowkey.split("|", 2)
+    return concept_id, create_date, key
+
+
+## 前缀对应的扫描区间 [row_start, row_stop), 与happybase row_prefix的计算方式一致
+def prefix_range(prefix):
+    if isinstance(prefix, str):
+        prefix = bytes(prefix, encoding="utf-8")
+    stop = prefix.rstrip(b"\xff")
+    if not stop:
+        return prefix, None
+    return prefix, stop[ : -1] + bytes([stop[-1] + 1])
+
+
+## 按concept_id与日期前缀扫描时, 各盐值分桶的扫描区间; create_date为空时扫描该concept_id全部日期
+def prefix_ranges(concept_id, create_date=None, buckets=SALT_BUCKETS):
+    prefix = concept_id + "|" + (create_date + "|" if create_date else "")
+    return [prefix_range(salt_prefix + prefix) for salt_prefix in salt_prefixes(buckets)]
+
+
+## 把采集日期区间 [start_date, end_date) 按天切分; 日期不是 %Y-%m-%d 格式时不切分
+def split_dates(start_date, end_date):
+    try:
+        start = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+        end = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        return [(start_date, end_date)]
+    dates = [(start + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days)] + [end_date]
+    return list(zip(dates[ : -1], dates[1 : ]))
+
+
+## concept_id采集日期在 [start_date, end_date) 内时, 各盐值分桶每天一个扫描区间
+## 不加盐时同一concept_id的多天数据也能分给多个线程并行扫描
+def date_ranges(concept_id, start_date, end_date, buckets=SALT_BUCKETS):
+    return [(bytes(salt_prefix + concept_id + "|" + day_start, encoding="utf-8"),
+             bytes(salt_prefix + concept_id + "|" + day_end, encoding="utf-8"))
+            for salt_prefix in salt_prefixes(buckets)
+            for day_start, day_end in split_dates(start_date, end_date)]
+
+
+## 预分区的分区键: 第一个分区从空rowkey开始, 其余每个盐值一个分区
+def split_keys(buckets=SALT_BUCKETS):
+    return [salt_prefix[ : 2] for salt_prefix in salt_prefixes(buckets)[1 : ]]
+
+
+## happybase建表不支持指定分区键, 生成hbase shell建表语句
+def create_table_script(table_name, buckets=SALT_BUCKETS, families=COLUMN_FAMILIES):
+    script = "create '{}'".format(table_name)
+    for family in families:
+        script += ", {{NAME => '{}'}}".format(family)
+    splits = split_keys(buckets)
+    if splits:
+        script += ", SPLITS => [{}]".format(", ".join("'{}'".format(key) for key in splits))
+    return script + "\n"
+
+
+## 多线程扫描多个区间, 按到达顺序返回 (rowkey, 数据); threads个扫描线程依次领取区间, 从连接池获取连接
+## threads为空时每个区间一个线程
+def parallel_scan(pool, table_name, ranges, columns=None, batch_size=SCAN_BATCH_SIZE, queue_size=SCAN_QUEUE_SIZE, threads=None):
+    results = queue.Queue(maxsize=queue_size)
+    pending = queue.Queue()              ## 尚未扫描的区间
+    stopped = threading.Event()          ## 调用方提前结束迭代时通知扫描线程退出
+    for scan_range in ranges:
+        pending.put(scan_range)
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def scan():
+        while not stopped.is_set():
+            try:
+                row_start, row_stop = pending.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                with pool.connection() as connection:
+                    table = connection.table(table_name)
+                    for row in table.scan(row_start=row_start, row_stop=row_stop, columns=columns, batch_size=batch_size):
+                        if not put(row):
+                            return
+            except Exception as e:
+                logger.error("扫描hbase出错, 区间: {} - {}, 原因: {}".format(row_start, row_stop, str(e)))
+                put(e)
+                return
+        put(None)
+
+    workers = [threading.Thread(target=scan, daemon=True) for _ in range(min(threads or len(ranges), len(ranges)))]
+    for worker in workers:
+        worker.start()
+
+    try:
+        running = len(workers)
+        while running:
+            item = results.get()
+            if item is None:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stopped.set()
+
+
+## 按concept_id与日期前缀扫描, 各盐值分桶并行
+def scan_prefix(pool, table_name, concept_id, create_date=None, columns=None, buckets=SALT_BUCKETS, batch_size=SCAN_BATCH_SIZE, threads=None):
+    return parallel_scan(pool, table_name, prefix_ranges(concept_id, create_date, buckets), columns, batch_size, threads=threads)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "create_table":
+        sys.stdout.write(create_table_script(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else SALT_BUCKETS))
+    else:
+        raise Exception("用法: python3 hbase_rowkey.py create_table <表名> [分桶数]")
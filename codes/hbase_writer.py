@@ -0,0 +1,105 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : hbase_writer.py
+# Description  : hbase并行批量写入；连接池 + 多个发送线程, 从有界队列中取批次写入,
+#                每批按batch_size自动分块发送, 失败时整批重试, 结束时输出 行/秒 与 字节/秒
+#******************************************************************************
+
+import time
+import queue
+import logging
+import threading
+import happybase
+
+logger = logging.getLogger(__name__)
+
+## 单批写入失败后的重试次数与重试间隔(秒), 间隔按重试次数递增
+WRITE_RETRIES = 3
+RETRY_INTERVAL = 5
+
+
+## put(tag, rows)把一批 (rowkey, {列: 值}) 放入队列, 由发送线程写入
+## 同rowkey的put直接覆盖, 整批重试不会产生重复数据; 每批写入结束后回调on_done(tag, 是否成功)
+## 队列长度有限, 发送跟不上时put阻塞, 读取端不会无限堆积数据
+class HBaseBatchWriter(object):
+
+    def __init__(self, host, port, table_name, senders=4, batch_size=1000, queue_size=None,
+                 retries=WRITE_RETRIES, on_done=None, metrics=None):
+        self.table_name = table_name
+        self.batch_size = batch_size        ## table.batch每攒够batch_size个put自动发送一次
+        self.retries = retries
+        self.on_done = on_done              ## 在锁内调用, 回调之间不会并发
+        self.metrics = metrics              ## JobMetrics, 记录write阶段
+
+        self.pool = happybase.ConnectionPool(size=senders, host=host, port=port)
+        self.queue = queue.Queue(maxsize=queue_size or senders * 2)
+        self.lock = threading.Lock()
+
+        self.row_count = 0                  ## 写入成功的行数
+        self.byte_count = 0                 ## 写入成功的字节数
+        self.failed_batches = 0             ## 重试后仍失败的批次数
+        self.start_time = time.time()
+
+        self.threads = []
+        for i in range(senders):
+            thread = threading.Thread(target=self.run, name="hbase-sender-{}".format(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+
+    def put(self, tag, rows):
+        self.queue.put((tag, rows))
+
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.send(*item)
+
+
+    def send(self, tag, rows):
+        batch_bytes = sum(len(rowkey) + sum(len(value) for value in data.values()) for rowkey, data in rows)
+        success = False
+        for attempt in range(self.retries + 1):
+            start_time = time.time()
+            try:
+                with self.pool.connection() as connection:
+                    table = connection.table(self.table_name)
+                    with table.batch(batch_size=self.batch_size) as batch:
+                        for rowkey, data in rows:
+                            batch.put(rowkey, data)
+                success = True
+                break
+            except Exception as e:
+                logger.error("写入hbase出错, 第 {} 次, 批次: {}, 原因: {}".format(attempt + 1, tag, str(e)))
+                if attempt < self.retries:
+                    time.sleep(RETRY_INTERVAL * (attempt + 1))
+
+        if self.metrics and success:
+            self.metrics.record("write", time.time() - start_time, len(rows), batch_bytes)
+        with self.lock:
+            if success:
+                self.row_count += len(rows)
+                self.byte_count += batch_bytes
+            else:
+                self.failed_batches += 1
+            if self.on_done:
+                self.on_done(tag, success)
+
+
+    ## 等待队列中的批次全部写入, 返回 (行/秒, 字节/秒)
+    def close(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        seconds = max(time.time() - self.start_time, 0.001)
+        rows_per_second = self.row_count / seconds
+        bytes_per_second = self.byte_count / seconds
+        logger.info("hbase写入 {} 行, {} MB, 平均 {} 行/秒, {} KB/秒, 失败 {} 批".format(
+            self.row_count, round(self.byte_count / 1024 / 1024, 1), int(rows_per_second), int(bytes_per_second / 1024), self.failed_batches))
+        return rows_per_second, bytes_per_second
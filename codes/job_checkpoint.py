@@ -0,0 +1,82 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : job_checkpoint.py
+# Description  : 任务断点记录；按 任务名+执行日期 保存本地状态文件, azkaban重试时从断点继续
+#******************************************************************************
+
+import os
+import json
+import logging
+import datetime
+from bson.objectid import ObjectId
+
+logger = logging.getLogger(__name__)
+
+## 断点文件目录
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "checkpoints")
+
+## mongodb按采集时间读取的排序: crawl_time不唯一, 以_id区分同一时间的资讯, 保证续跑时顺序确定
+MONGO_RESUME_SORT = [("crawl_time", 1), ("_id", 1)]
+
+## 断点文件中采集时间的格式, 保留毫秒
+POSITION_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+## 资讯在MONGO_RESUME_SORT顺序中的位置 [crawl_time, _id], 转为字符串保存在断点文件中
+def mongo_position(doc):
+    return [doc["crawl_time"].strftime(POSITION_TIME_FORMAT), str(doc["_id"])]
+
+
+## 在查询条件上加上断点位置之后的范围, 用于续跑时代替skip; position为空时原样返回
+def mongo_resume_query(query, position):
+    if not position:
+        return query
+    crawl_time = datetime.datetime.strptime(position[0], POSITION_TIME_FORMAT)
+    _id = ObjectId(position[1])
+    after = {"$or": [{"crawl_time": {"$gt": crawl_time}}, {"crawl_time": crawl_time, "_id": {"$gt": _id}}]}
+    return {"$and": [query, after]}
+
+
+class JobCheckpoint(object):
+
+    def __init__(self, job_name, date_str, checkpoint_dir=None):
+        self.job_name = job_name
+        self.date_str = date_str
+        self.path = os.path.join(checkpoint_dir or CHECKPOINT_DIR, "{}_{}.json".format(job_name, date_str))
+        self.state = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.state = json.load(f)
+            except Exception as e:
+                logger.error("断点文件读取失败, 从头执行: {}, 原因: {}".format(self.path, str(e)))
+
+        ## 上次已完整执行, 说明是人工重跑, 从头开始
+        if self.state.get("completed"):
+            logger.info("任务 {} 日期 {} 上次已执行完成, 本次从头执行".format(job_name, date_str))
+            self.state = {}
+        elif self.state:
+            logger.info("任务 {} 日期 {} 从断点继续执行: {}".format(job_name, date_str, self.state))
+
+
+    def get(self, name, default=None):
+        return self.state.get(name, default)
+
+
+    ## 更新断点, 先写临时文件再替换, 避免写一半时任务被杀导致断点文件损坏
+    def save(self, **values):
+        self.state.update(values)
+        self.state["update_time"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+    ## 标记该日期执行完成
+    def complete(self, **values):
+        self.save(completed=True, **values)
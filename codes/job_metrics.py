@@ -0,0 +1,189 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : job_metrics.py
+# Description  : 任务分阶段耗时与吞吐统计；记录各阶段(读取、转换、服务调用、去重、写入)的耗时分布、
+#                文档数与字节数, 运行结束时输出json汇总与node exporter可采集的prometheus文本文件
+#******************************************************************************
+
+import os
+import json
+import time
+import socket
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+## 统计结果输出目录, prometheus文本文件需在node exporter的 --collector.textfile.directory 下
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "metrics")
+PROM_TEXTFILE_DIR = METRICS_DIR
+
+## 阶段耗时直方图的分桶上界(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300)
+
+
+class StageStats(object):
+
+    def __init__(self):
+        self.calls = 0                  ## 调用次数
+        self.docs = 0                   ## 处理文档数
+        self.bytes = 0                  ## 处理字节数
+        self.seconds = 0.0              ## 累计耗时
+        self.max_seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+    def add(self, seconds, docs, nbytes):
+        self.calls += 1
+        self.docs += docs
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "docs": self.docs,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "max_seconds": round(self.max_seconds, 3),
+            "avg_seconds": round(self.seconds / self.calls, 3) if self.calls else 0,
+            "docs_per_second": round(self.docs / self.seconds, 2) if self.seconds else 0,
+            "bytes_per_second": round(self.bytes / self.seconds, 2) if self.seconds else 0,
+            "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS], self.buckets))
+        }
+
+
+class JobMetrics(object):
+
+    def __init__(self, job_name, date_str=""):
+        self.job_name = job_name
+        self.date_str = date_str
+        self.start_time = time.time()
+        self.stages = {}                ## 阶段名 -> StageStats, 按首次出现的顺序输出
+        self.counts = {}                ## 任务汇总计数, 如 news_count、arango_count
+        self.lock = threading.Lock()    ## 服务调用等阶段在线程池中记录
+
+
+    def record(self, stage, seconds, docs=0, nbytes=0):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageStats()
+            self.stages[stage].add(seconds, docs, nbytes)
+
+
+    ## with metrics.stage("write", docs=len(batch)): ...
+    ## 文档数与字节数在进入时未知的, 可在with块内通过返回的dict补充
+    @contextmanager
+    def stage(self, name, docs=0, nbytes=0):
+        sizes = {"docs": docs, "bytes": nbytes}
+        start_time = time.time()
+        try:
+            yield sizes
+        finally:
+            self.record(name, time.time() - start_time, sizes["docs"], sizes["bytes"])
+
+
+    ## 包装游标等可迭代对象, 每取一条记一次读取耗时
+    def timed_iter(self, stage, iterable, size_fn=None):
+        iterator = iter(iterable)
+        while True:
+            start_time = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, time.time() - start_time, 1, size_fn(item) if size_fn else 0)
+            yield item
+
+
+    def set_count(self, name, value):
+        self.counts[name] = value
+
+
+    def summary(self):
+        duration = time.time() - self.start_time
+        with self.lock:
+            stages = dict((name, stats.summary()) for name, stats in self.stages.items())
+        return {
+            "job": self.job_name,
+            "date": self.date_str,
+            "host": socket.gethostname(),
+            "start_time": datetime.datetime.fromtimestamp(self.start_time).strftime("%Y-%m-%d %H:%M:%S"),
+            "duration_seconds": round(duration, 3),
+            "counts": dict(self.counts),
+            "stages": stages
+        }
+
+
+    def prometheus_text(self, summary):
+        job = self.job_name
+        lines = []
+
+        lines.append("# HELP news_job_stage_seconds Stage latency of news jobs.")
+        lines.append("# TYPE news_job_stage_seconds histogram")
+        with self.lock:
+            for name, stats in self.stages.items():
+                labels = 'job="{}",stage="{}"'.format(job, name)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append('news_job_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+                lines.append('news_job_stage_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, stats.calls))
+                lines.append("news_job_stage_seconds_sum{{{}}} {}".format(labels, stats.seconds))
+                lines.append("news_job_stage_seconds_count{{{}}} {}".format(labels, stats.calls))
+
+        for metric, field, help_text in [("news_job_stage_docs", "docs", "Documents handled by stage."),
+                                         ("news_job_stage_bytes", "bytes", "Payload bytes handled by stage."),
+                                         ("news_job_stage_docs_per_second", "docs_per_second", "Stage throughput in documents per second.")]:
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} gauge".format(metric))
+            for name, stats in summary["stages"].items():
+                lines.append('{}{{job="{}",stage="{}"}} {}'.format(metric, job, name, stats[field]))
+
+        lines.append("# HELP news_job_count Summary counters of the last run.")
+        lines.append("# TYPE news_job_count gauge")
+        for name, value in summary["counts"].items():
+            lines.append('news_job_count{{job="{}",name="{}"}} {}'.format(job, name, value))
+
+        lines.append("# HELP news_job_duration_seconds Duration of the last run.")
+        lines.append("# TYPE news_job_duration_seconds gauge")
+        lines.append('news_job_duration_seconds{{job="{}"}} {}'.format(job, summary["duration_seconds"]))
+        lines.append("# HELP news_job_last_run_timestamp_seconds End time of the last run.")
+        lines.append("# TYPE news_job_last_run_timestamp_seconds gauge")
+        lines.append('news_job_last_run_timestamp_seconds{{job="{}"}} {}'.format(job, int(time.time())))
+        return "\n".join(lines) + "\n"
+
+
+    ## 输出json汇总(按任务与日期)与prometheus文本文件(按任务, 每次覆盖)
+    def write(self):
+        summary = self.summary()
+        try:
+            json_name = "{}_{}.json".format(self.job_name, self.date_str) if self.date_str else "{}.json".format(self.job_name)
+            self._write_file(os.path.join(METRICS_DIR, json_name), json.dumps(summary, ensure_ascii=False, indent=2))
+            ## node exporter只读取.prom文件, 先写临时文件再替换, 避免读到一半的内容
+            self._write_file(os.path.join(PROM_TEXTFILE_DIR, "{}.prom".format(self.job_name)), self.prometheus_text(summary))
+        except Exception as e:
+            logger.error("任务统计结果输出失败: {}".format(str(e)))
+
+        for name, stats in summary["stages"].items():
+            logger.info("阶段 [{}]: 调用 {} 次, 文档 {} 条, 耗时 {} 秒, {} 条/秒"
+                        .format(name, stats["calls"], stats["docs"], stats["seconds"], stats["docs_per_second"]))
+        return summary
+
+
+    @staticmethod
+    def _write_file(path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
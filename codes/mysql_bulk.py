@@ -0,0 +1,251 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : mysql_bulk.py
+# Description  : mysql批量写入；每个数据库复用一个连接，缓存数据行，
+#                按块executemany执行 INSERT ... ON DUPLICATE KEY UPDATE, 每块一个事务;
+#                parallel模式下每个数据库由单独的线程写入, 互不等待;
+#                大批量回填时先写本地文件, LOAD DATA LOCAL INFILE导入临时表后合并到目标表
+#******************************************************************************
+
+import os
+import time
+import queue
+import logging
+import tempfile
+import threading
+import pymysql
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+## 按upsert语句的格式拼接 INSERT ... ON DUPLICATE KEY UPDATE 的更新部分
+def update_clause(columns, key_column):
+    return ", ".join("`{0}`=VALUES(`{0}`)".format(column) for column in columns if column != key_column)
+
+
+## LOAD DATA默认格式的字段转义: 制表符分隔, 反斜杠转义, None为\N
+def load_data_field(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class MysqlBulkWriter(object):
+
+    def __init__(self, host, port, user, passwd, table, columns, key_column="id", chunk_size=500, charset="utf8mb4", metrics=None, parallel=False):
+        self.connect_params = {"host": host, "port": port, "user": user, "passwd": passwd, "charset": charset}
+        self.chunk_size = chunk_size
+        self.metrics = metrics          ## JobMetrics, 记录write阶段
+        self.parallel = parallel        ## 每个数据库一个写入线程
+        self.key_column = key_column
+
+        ## 主键相同的行直接覆盖其他字段
+        self.sql = "INSERT INTO `{}` ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+            table,
+            ", ".join("`{}`".format(column) for column in columns),
+            ", ".join(["%s"] * len(columns)),
+            update_clause(columns, key_column))
+        self.key_index = columns.index(key_column)
+
+        self.connections = {}           ## 数据库名 -> 连接
+        self.rows = {}                  ## 数据库名 -> [(计数标签, 数据行)]
+        self.saved_count = {}           ## 计数标签 -> 写入成功的行数
+        self.failed_count = 0           ## 写入失败的行数
+        self.workers = {}               ## 数据库名 -> (写入线程, 待写入队列)
+        self.lock = threading.Lock()
+
+
+    def connection(self, db):
+        connector = self.connections.get(db)
+        if connector is None:
+            connector = pymysql.connect(db=db, **self.connect_params)
+            self.connections[db] = connector
+        else:
+            ## 长时间空闲后连接可能被服务端断开
+            connector.ping(reconnect=True)
+        return connector
+
+
+    ## 缓存一行数据, tag为写入成功后计数的标签
+    def add(self, db, row, tag=None):
+        if self.parallel:
+            self.worker_queue(db).put((tag, row))
+            return
+        rows = self.rows.setdefault(db, [])
+        rows.append((tag, row))
+        if len(rows) >= self.chunk_size:
+            self.flush(db)
+
+
+    ## 数据库的写入队列, 第一次使用时启动写入线程
+    ## 队列不限长度, 某个数据库写入慢时只积压该库的数据, 不阻塞其他数据库
+    def worker_queue(self, db):
+        if db not in self.workers:
+            rows_queue = queue.Queue()
+            worker = threading.Thread(target=self.run, args=(db, rows_queue), name="mysql-" + db, daemon=True)
+            worker.start()
+            self.workers[db] = (worker, rows_queue)
+        return self.workers[db][1]
+
+
+    ## 写入线程: 攒满一块写入一次, 收到None时写入剩余数据并退出
+    def run(self, db, rows_queue):
+        rows = []
+        while True:
+            item = rows_queue.get()
+            if item is not None:
+                rows.append(item)
+            if rows and (item is None or len(rows) >= self.chunk_size):
+                self.write(db, rows)
+                rows = []
+            if item is None:
+                break
+
+
+    ## 写入缓存的数据, db为空时写入全部数据库; parallel模式下由写入线程自行写入, close时等待完成
+    def flush(self, db=None):
+        for name in ([db] if db else list(self.rows)):
+            rows, self.rows[name] = self.rows.get(name, []), []
+            if rows:
+                self.write(name, rows)
+
+
+    def write(self, db, rows):
+        start_time = time.time()
+        try:
+            connector = self.connection(db)
+            with connector.cursor() as cursor:
+                cursor.executemany(self.sql, [row for tag, row in rows])
+            connector.commit()
+            saved_rows = rows
+        except Exception as e:
+            logger.error("批量写入mysql出错, 数据库: {}, 逐条重试, 原因: {}".format(db, str(e)))
+            saved_rows = self.write_one_by_one(db, rows)
+
+        if self.metrics:
+            self.metrics.record("write", time.time() - start_time, len(rows))
+        with self.lock:
+            for tag, row in saved_rows:
+                self.saved_count[tag] = self.saved_count.get(tag, 0) + 1
+            self.failed_count += len(rows) - len(saved_rows)
+
+
+    ## 批量写入失败时逐条写入, 找出出错的数据行; 返回写入成功的行
+    def write_one_by_one(self, db, rows):
+        saved_rows = []
+        try:
+            connector = self.connection(db)
+            connector.rollback()
+        except Exception as e:
+            logger.error("连接mysql出错, 数据库: {}, 原因: {}".format(db, str(e)))
+            self.connections.pop(db, None)
+            return saved_rows
+
+        for tag, row in rows:
+            try:
+                with connector.cursor() as cursor:
+                    cursor.execute(self.sql, row)
+                connector.commit()
+                saved_rows.append((tag, row))
+            except Exception as e:
+                connector.rollback()
+                logger.error(str(e))
+                logger.info("插入错误, 资讯id: {}".format(row[self.key_index]))
+        return saved_rows
+
+
+    def close(self):
+        for worker, rows_queue in self.workers.values():
+            rows_queue.put(None)
+        for worker, rows_queue in self.workers.values():
+            worker.join()
+        self.workers = {}
+        self.flush()
+        for connector in self.connections.values():
+            try:
+                connector.close()
+            except Exception:
+                pass
+        self.connections = {}
+
+
+## 大批量回填: 数据行按数据库写入本地文件, 再用 LOAD DATA LOCAL INFILE 导入临时表,
+## 最后 INSERT ... SELECT ... ON DUPLICATE KEY UPDATE 合并到目标表, 各数据库并行导入
+class MysqlStagingLoader(object):
+
+    def __init__(self, host, port, user, passwd, table, columns, key_column="id", staging_dir=None, charset="utf8mb4", metrics=None):
+        self.connect_params = {"host": host, "port": port, "user": user, "passwd": passwd, "charset": charset, "local_infile": True}
+        self.table = table
+        self.staging_table = table + "_staging"
+        self.columns = columns
+        self.key_column = key_column
+        self.charset = charset
+        self.metrics = metrics
+        self.staging_dir = tempfile.mkdtemp(prefix="mysql_staging_", dir=staging_dir)
+
+        self.files = {}                 ## 数据库名 -> 本地文件
+        self.row_counts = {}            ## 数据库名 -> {计数标签: 行数}
+        self.saved_count = {}           ## 计数标签 -> 导入成功的行数
+        self.stats = {}                 ## 数据库名 -> (导入行数, 耗时)
+
+
+    def path(self, db):
+        return os.path.join(self.staging_dir, "{}.tsv".format(db))
+
+
+    def add(self, db, row, tag=None):
+        if db not in self.files:
+            self.files[db] = open(self.path(db), "w", encoding="utf-8", newline="\n")
+            self.row_counts[db] = {}
+        self.files[db].write("\t".join(load_data_field(value) for value in row) + "\n")
+        self.row_counts[db][tag] = self.row_counts[db].get(tag, 0) + 1
+
+
+    def load_db(self, db):
+        columns = ", ".join("`{}`".format(column) for column in self.columns)
+        start_time = time.time()
+        connector = pymysql.connect(db=db, **self.connect_params)
+        try:
+            with connector.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS `{}`".format(self.staging_table))
+                cursor.execute("CREATE TABLE `{}` LIKE `{}`".format(self.staging_table, self.table))
+                count = cursor.execute("""LOAD DATA LOCAL INFILE %s INTO TABLE `{}` CHARACTER SET {}
+                                          FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({})"""
+                                       .format(self.staging_table, self.charset, columns), (self.path(db), ))
+                cursor.execute("INSERT INTO `{0}` ({1}) SELECT {1} FROM `{2}` ON DUPLICATE KEY UPDATE {3}"
+                               .format(self.table, columns, self.staging_table, update_clause(self.columns, self.key_column)))
+                cursor.execute("DROP TABLE IF EXISTS `{}`".format(self.staging_table))
+            connector.commit()
+        finally:
+            connector.close()
+        return count, time.time() - start_time
+
+
+    ## 关闭本地文件, 各数据库并行导入; 返回 数据库名 -> (导入行数, 耗时)
+    def load(self, max_workers=None):
+        for data_file in self.files.values():
+            data_file.close()
+
+        dbs = list(self.files)
+        with ThreadPoolExecutor(max_workers=max_workers or max(1, len(dbs))) as executor:
+            futures = dict((db, executor.submit(self.load_db, db)) for db in dbs)
+
+        for db, future in futures.items():
+            try:
+                count, seconds = future.result()
+            except Exception as e:
+                logger.error("数据库 {} 导入出错, 本地文件保留在: {}, 原因: {}".format(db, self.path(db), str(e)))
+                continue
+            self.stats[db] = (count, seconds)
+            if self.metrics:
+                self.metrics.record("write", seconds, count)
+            for tag, rows in self.row_counts[db].items():
+                self.saved_count[tag] = self.saved_count.get(tag, 0) + rows
+            os.remove(self.path(db))
+
+        ## 全部导入成功时删除临时目录, 有失败时保留文件用于排查
+        if not os.listdir(self.staging_dir):
+            os.rmdir(self.staging_dir)
+        return self.stats
@@ -11,9 +11,11 @@ import sys
 import logging
 import datetime
 import time
-import json
 from elasticsearch import Elasticsearch
 from pyArango.connection import Connection as ArangoConnection
+from job_metrics import JobMetrics
+from arango_reader import ArangoUpdateReader
+from es_bulk import EsBulkIndexer
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -24,6 +26,13 @@ logger = logging.getLogger(__name__)
 ## ES新闻库
 
 
+## 每个bulk请求的资讯数(也是查重msearch的块大小), 写入线程数
+ES_CHUNK_SIZE = 500
+ES_THREAD_COUNT = 4
+
+## 同步需要读取的资讯字段
+READ_FIELDS = ["title", "publish_time", "url", "content", "abstract", "html", "source", "img_url", "tags", "entities"]
+
 class NewsArango2es(object):
 
     def process(self, date_str):
@@ -40,6 +49,7 @@ class NewsArango2es(object):
         next_date = datetime.datetime.strftime(next_date, "%Y-%m-%d")
 
         start_time = time.time()
+        metrics = JobMetrics("news_arango2es", date_str)
         es = Elasticsearch(ES_URL)
         ## 从arangodb获取需要同步的资讯
         arango_connector = ArangoConnection(arangoURL=ARANGO_URL,
@@ -47,21 +57,11 @@ class NewsArango2es(object):
                                             password=ARANGO_PASSWD)
 
         arango_db = arango_connector[ARANGO_DB]
-        aql = "for x in {} FILTER x.update_time >= \"{}\" AND x.update_time <= \"{}\" RETURN x".format(ARANGO_COLLECTION, process_date, next_date)
-        results = []
-        try:
-            results = arango_db.fetch_list(aql)
-        except Exception as e:
-            logger.error("查询arangodb错误: " + str(e))
-        arango_count = len(results)
-
-        for result in results:
-            doc = {}
-            _id = result["_key"]
-            ## 同id覆盖问题
-            if es.exists(index=ES_INDEX, doc_type="event", id=_id):
-                es.delete(index=ES_INDEX, doc_type="event", id=_id, params={'refresh':'true'})
+        reader = ArangoUpdateReader(arango_db, ARANGO_COLLECTION, READ_FIELDS)
 
+        ## 资讯转换为es文档, 不需要导入时返回None
+        def transform(result):
+            doc = {}
             doc["title"] = result["title"]
             doc["date"] = result["publish_time"].split(" ")[0]
             doc["createTime"] = datetime.datetime.today().strftime("%Y-%m-%d")
@@ -71,16 +71,16 @@ class NewsArango2es(object):
             doc["html"] = result["html"]
             doc["source"] = result["source"]
             if doc["source"] != "公众号":
-                continue
+                return None
 
             doc["area"] = ""
             doc["park"] = ""
-            
+        
             doc["logo"] = ""
             imgs = result["img_url"]
             if imgs:
                 doc["logo"] = imgs[0]
-            
+        
             ## 行业、领域、标签分类
             doc["industry"] = ""
             doc["domain"] = ""
@@ -97,7 +97,7 @@ class NewsArango2es(object):
 
             if not doc["industry"]:
                 logger.info("该资讯没有行业分类: {}".format(doc["title"]))
-                continue
+                return None
             ## 生物医药行业合并
             if doc["industry"] in ["生物制药", "医疗器械"]:
                 doc["industry"] = "生物医药"
@@ -109,30 +109,28 @@ class NewsArango2es(object):
             if len(entities) > 0:
                 doc["company_id"] = entities[0]["externalReference"]["id"].split("/")[1]
                 doc["company_name"] = entities[0]["externalReference"]["name"]
+            return doc
+
+        ## 按_id覆盖写入, 不再逐条 exists + delete; 按块查重后由parallel_bulk多线程批量写入
+        def docs():
+            for result in metrics.timed_iter("read", reader.read(process_date, next_date)):
+                doc = transform(result)
+                if doc is not None:
+                    yield result["_key"], doc
 
-            ## 判断去重
-            query = {
-                "query": {
-                    "match": {
-                        "title": doc["title"]
-                    }
-                }
-            }
-
-            try:
-                score = es.search(index=ES_INDEX, body=query)["hits"]["max_score"]
-                if score and score > 2.0:
-                    logger.info("发现类似资讯")
-                    continue
-
-                es.index(index=ES_INDEX, doc_type="event", id=_id, body=json.dumps(doc, ensure_ascii=False), request_timeout=30)
-                es_count += 1
-            except Exception as e:
-                logger.error(str(e))
+        indexer = EsBulkIndexer(es, ES_INDEX, "event", chunk_size=ES_CHUNK_SIZE, thread_count=ES_THREAD_COUNT, metrics=metrics)
+        es_count = indexer.index(docs())
+        arango_count = reader.count
 
         end_time = time.time()
         logger.info("本次往es同步工作完成, 日期: {}, 从arango读取 [{}] 条, 导入es [{}] 条, 耗时: {} 秒".format(date_str, arango_count, es_count, int(end_time - start_time)))
 
+        metrics.set_count("arango_count", arango_count)
+        metrics.set_count("es_count", es_count)
+        metrics.set_count("duplicate_count", indexer.duplicate_count)
+        metrics.set_count("es_failed_count", indexer.failed_count)
+        metrics.write()
+
 
 if __name__ == "__main__":
     news_arango2es = NewsArango2es()
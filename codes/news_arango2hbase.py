@@ -15,49 +15,54 @@ import requests
 import json
 import time
 import datetime
+import itertools
 from dateutil import parser
-import pymysql
-import happybase
 from pyArango.connection import Connection as ArangoConnection
+from job_checkpoint import JobCheckpoint
+from job_metrics import JobMetrics
+from arango_reader import ArangoUpdateReader
+from hbase_writer import HBaseBatchWriter
+from hbase_codec import HBaseCodec
+from hbase_rowkey import SALT_BUCKETS, build_rowkey
+from concept_cache import ConceptSnapshot
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 ## 资讯概念体系mysql数据库
 
+## 概念表中数据源与concept_id所在的列: 原 select * 结果的第1列与第6列, 列名在第一次查询mysql时解析; 本地快照有效期(秒)
+MYSQL_SOURCE_COLUMN = 0
+MYSQL_CONCEPT_COLUMN = 5
+CONCEPT_CACHE_TTL = 6 * 3600
+
 ## 导入目标arangodb数据库
 
 
 ##导入Hbase
 
+## hbase发送线程数(连接池大小), 每次发送的put数
+HBASE_SENDERS = 4
+HBASE_BATCH_SIZE = 1000
+
+## 同步需要读取的资讯字段
+READ_FIELDS = ["source", "create_time", "html", "title", "content", "url", "abstract", "img_url", "tags", "entities", "publish_time"]
 
 class NewsArango2hbase(object):
 
     def __init__(self):
-        self.news_concept = {}          ## 资讯的概念体系对应表
+        self.news_concept = None        ## 资讯的概念体系对应表: 数据源 -> concept_id
         self.get_news_concept()
         self.arango_count = 0           ## arangodb需要同步的资讯数量
         self.hbase_count = 0            ## 导入hbase的资讯数量
 
 
+    ## 概念对应表使用本地快照, 第一次用到时才加载, 有快照时启动不需要连接mysql
     def get_news_concept(self):
-        mysql_connector = pymysql.connect(host=MYSQL_HOST,
-                                          port=MYSQL_PORT,
-                                          user=MYSQL_USER,
-                                          passwd=MYSQL_PASSWD,
-                                          db=MYSQL_DB,
-                                          charset="utf8")
-        mysql_cursor = mysql_connector.cursor()
-        query = "select * from {} where type=\"news\"".format(MYSQL_TABLE)
-        
-        count = mysql_cursor.execute(query)
-        if count > 0:
-            results = mysql_cursor.fetchall()
-            for result in results:
-                self.news_concept[result[0]] = result[5]
-            logger.info("资讯概念关系表加载完成!")
-        else:
-            logger.error("资讯概念关系表加载失败!")
+        connect_params = {"host": MYSQL_HOST, "port": MYSQL_PORT, "user": MYSQL_USER, "passwd": MYSQL_PASSWD,
+                          "db": MYSQL_DB, "charset": "utf8"}
+        self.news_concept = ConceptSnapshot("news", connect_params, MYSQL_TABLE, MYSQL_SOURCE_COLUMN, MYSQL_CONCEPT_COLUMN,
+                                            where={"type": "news"}, ttl=CONCEPT_CACHE_TTL)
 
     
     ## 同步主函数
@@ -76,6 +81,7 @@ class NewsArango2hbase(object):
         logger.info("执行采集日期为: {} 的资讯同步任务, 从arangodb导入hbase".format(process_date))
 
         start_time = time.time()
+        metrics = JobMetrics("news_arango2hbase", process_date)
 
         ## 从arangodb获取需要同步的资讯
         arango_connector = ArangoConnection(arangoURL=ARANGO_URL,
@@ -84,26 +90,51 @@ class NewsArango2hbase(object):
 
         arango_db = arango_connector[ARANGO_DB]
 
-        aql = "for x in {} FILTER x.update_time >= \"{}\" AND x.update_time <= \"{}\" RETURN x".format(ARANGO_COLLECTION, process_date, next_date)
-        
-        results = []
-        try:
-            results = arango_db.fetch_list(aql)
-        except Exception as e:
-            logger.error("查询arangodb错误: " + str(e))
-        self.arango_count = len(results)
-
-        for i in range(0, self.arango_count, BATCH_SIZE):
-            start = i
-            end = min(self.arango_count, start + BATCH_SIZE)
+        ## 断点续跑: 按_key排序读取, 跳过上次已写入hbase的资讯
+        checkpoint = JobCheckpoint("news_arango2hbase", process_date)
+        last_key = checkpoint.get("last_key", "")
+        done_count = checkpoint.get("arango_count", 0)
+        self.hbase_count = checkpoint.get("hbase_count", 0)
+
+        reader = ArangoUpdateReader(arango_db, ARANGO_COLLECTION, READ_FIELDS)
+        results = metrics.timed_iter("read", reader.read(process_date, next_date, after_key=last_key))
+
+        ## 写入按批次完成的顺序回调, 断点只推进到连续写入成功的最后一批, 中断后从第一个未完成的批次重跑
+        ## 重跑的批次rowkey不变, hbase中直接覆盖
+        finished = {}                   ## 批次序号 -> (写入是否成功, 读取条数, 写入条数, 批次最后的_key)
+        state = {"next_index": 0, "done_count": done_count}
+
+        ## 计数只累计到连续写入成功的最后一批, 与断点一致; 失败批次之后已写入的批次重跑时会再次写入, 不能提前计数
+        def on_done(tag, success):
+            index, read_count, row_count, batch_last_key = tag
+            finished[index] = (success, read_count, row_count, batch_last_key)
+            while state["next_index"] in finished and finished[state["next_index"]][0]:
+                success, read_count, row_count, batch_last_key = finished.pop(state["next_index"])
+                state["next_index"] += 1
+                state["done_count"] += read_count
+                self.hbase_count += row_count
+                checkpoint.save(last_key=batch_last_key, arango_count=state["done_count"], hbase_count=self.hbase_count)
+
+        ## 读取、转换在主线程进行, 写入由多个发送线程并行完成
+        writer = HBaseBatchWriter(HBASE_HOST, HBASE_PORT, HBASE_TABLE, senders=HBASE_SENDERS,
+                                  batch_size=HBASE_BATCH_SIZE, on_done=on_done, metrics=metrics)
+        ## raw:html、info:content压缩后写入, 读取时用hbase_codec.decode_row解压
+        codec = HBaseCodec()
+
+        end = 0
+        index = 0
+        while True:
             batch_start_time = time.time()
+            batch_results = list(itertools.islice(results, BATCH_SIZE))
+            if not batch_results:
+                break
+            start = end
+            end = start + len(batch_results)
 
-            ## hbase连接
-            hbase_connector = happybase.Connection(host=HBASE_HOST, port=HBASE_PORT)
-            hbase_table = hbase_connector.table(HBASE_TABLE)
-            hbase_batch = hbase_table.batch()
+            rows = []
+            transform_start_time = time.time()
 
-            for result in results[start : end]:
+            for result in batch_results:
                 ## 判断资讯的数据源是否写入mysql的概念表
                 source = result["source"]
                 if source not in self.news_concept:
@@ -111,8 +142,8 @@ class NewsArango2hbase(object):
                     continue
 
                 concept_id = self.news_concept[source]
-                rowkey = concept_id + "|" + result["create_time"][:10] + "|" + result["_key"]
-                rowkey = bytes(rowkey, encoding="utf-8")
+                ## 盐值分桶数在hbase_rowkey.SALT_BUCKETS中统一配置, 与news_hbase_reader共用
+                rowkey = build_rowkey(concept_id, result["create_time"][:10], result["_key"], SALT_BUCKETS)
 
                 column_family = {
                     b"raw:html":            bytes(result["html"], encoding="utf8"),
@@ -130,19 +161,42 @@ class NewsArango2hbase(object):
                     b"info:insert_time":    bytes(datetime.date.today().strftime("%Y-%m-%d %H:%M:%S"), encoding="utf8")
                 }
 
-                hbase_batch.put(rowkey, column_family)
-            
-            hbase_batch.send()
-            self.hbase_count += (end - start)
-            hbase_connector.close()
+                rows.append((rowkey, codec.encode_row(column_family)))
+
+            metrics.record("transform", time.time() - transform_start_time, end - start)
+            ## 队列满时等待发送线程, 读取不会超前太多
+            writer.put((index, end - start, len(rows), batch_results[-1]["_key"]), rows)
+            index += 1
 
             batch_end_time = time.time()
-            logger.info("第 {} - {} 条数据处理结束, 共耗时: {} 秒".format(start, end, int(batch_end_time - batch_start_time)))
+            logger.info("第 {} - {} 条数据转换结束, 共耗时: {} 秒".format(start, end, int(batch_end_time - batch_start_time)))
+
+        rows_per_second, bytes_per_second = writer.close()
+        self.news_concept.wait()
+        compress_ratio, saved_bytes, saved_seconds = codec.report(bytes_per_second)
+
+        self.arango_count = done_count + reader.count
+        if writer.failed_batches:
+            logger.error("hbase写入失败 {} 批, 断点保留在第一个失败的批次之前".format(writer.failed_batches))
+        else:
+            checkpoint.complete(arango_count=self.arango_count, hbase_count=self.hbase_count)
 
         end_time = time.time()
         logger.info("本次资讯由arangodb同步到hbase处理完成，共耗时: {} 秒".format(int(end_time - start_time)))
         logger.info("其中共需要同步资讯数据: {} 条, 导入hbase: {} 条".format(self.arango_count, self.hbase_count))
 
+        metrics.set_count("arango_count", self.arango_count)
+        metrics.set_count("hbase_count", self.hbase_count)
+        metrics.set_count("rows_per_second", int(rows_per_second))
+        metrics.set_count("bytes_per_second", int(bytes_per_second))
+        metrics.set_count("compress_ratio", round(compress_ratio, 3))
+        metrics.set_count("compress_saved_bytes", saved_bytes)
+        metrics.set_count("compress_saved_seconds", round(saved_seconds, 1))
+        metrics.write()
+
+        if writer.failed_batches:
+            raise Exception("hbase写入失败 {} 批, 请重新执行".format(writer.failed_batches))
+
 
 if __name__ == "__main__":
     news_arango2hbase = NewsArango2hbase()
@@ -7,14 +7,19 @@
 # Description  : 同步脚本, 将news从arangodb同步到mysql
 #******************************************************************************
 
+import os
 import sys
 import logging
 import datetime
 import time
 import json
 import pymysql
+from collections import OrderedDict
 from tqdm import tqdm
 from pyArango.connection import Connection as ArangoConnection
+from job_metrics import JobMetrics
+from arango_reader import ArangoUpdateReader
+from mysql_bulk import MysqlBulkWriter, MysqlStagingLoader
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -25,57 +30,67 @@ logger = logging.getLogger(__name__)
 ##mysql数据库
 
 
+## 同步需要读取的资讯字段
+READ_FIELDS = ["title", "publish_time", "url", "abstract", "tags"]
+
+## 资讯行业 -> (统计的行业名, 写入的数据库), 新增行业在此添加
+INDUSTRY_ROUTES = OrderedDict([
+    ("人工智能",     ("人工智能", AI_DB)),
+    ("光电产业",     ("光电产业", OP_DB)),
+    ("新能源汽车",   ("新能源汽车", NECAR_DB)),
+    ("生物制药",     ("生物医药", MED_DB)),
+    ("医疗器械",     ("生物医药", MED_DB)),
+    ("地理信息",     ("地理信息", GEO_DB)),
+    ("5G产业",       ("5G产业", _5G_DB)),
+])
+
+## 写入的event表字段与每个事务写入的行数
+EVENT_COLUMNS = ["id", "name", "time", "tags", "content"]
+MYSQL_BULK_SIZE = 500
+
+## 回填模式的本地临时文件目录
+BACKFILL_STAGING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "staging")
+
+
 class NewsArango2mysql(object):
 
     def __init__(self):
         self.arango_count = 0         ## arango找到的资讯数目
-        self.mysql_count = {
-            "人工智能": 0,
-            "地理信息": 0,
-            "生物医药": 0,
-            "光电产业": 0,
-            "新能源汽车": 0,
-            "5G产业": 0
-        }
-
-    def insert(self, doc, industry):
-
-        db = None
-        if industry == "人工智能":
-            db = AI_DB
-        elif industry == "地理信息":
-            db = GEO_DB
-        elif industry in ["生物制药", "医疗器械"]:
-            industry = "生物医药"
-            db = MED_DB
-        elif industry == "光电产业":
-            db = OP_DB
-        elif industry == "新能源汽车":
-            db = NECAR_DB
-        elif industry == "5G产业":
-            db = _5G_DB
-        else:
+        self.mysql_count = OrderedDict((industry, 0) for industry, db in INDUSTRY_ROUTES.values())
+
+
+    ## 由arangodb资讯生成event数据, 返回 (event, 行业列表), 没有事件的资讯返回 (None, [])
+    def transform(self, result):
+        doc = {}
+        doc["id"] = result["_key"]
+        doc["name"] = result["title"]
+        doc["time"] = result["publish_time"].split(" ")[0]
+        doc["url"] = result["url"]
+        doc["content"] = result["abstract"]
+        
+        industrys = []       ## 资讯的行业分类, 存在某个企业对应多个行业的情况
+        tags = result["tags"]
+        for tag in tags:
+            if tag["conceptName"] == "产业":
+                industrys.append(tag["name"])
+            if tag["conceptName"] == "事件":
+                doc["event_type"] = tag["name"]
+
+        ## 没有事件就不导入
+        if "event_type" not in doc:
+            return None, []
+        return doc, list(set(industrys))
+
+
+    ## 按行业选择数据库, 缓存到writer批量写入; writer也可以是回填模式的MysqlStagingLoader
+    def insert(self, writer, doc, industry):
+        if industry not in INDUSTRY_ROUTES:
             logger.info("尚不支持该行业数据插入: {}".format(industry))
             return
 
-        sql_connector = pymysql.connect(host=MYSQL_HOST,
-                                        port=MYSQL_PORT,
-                                        user=MYSQL_USER,
-                                        passwd=MYSQL_PASSWD,
-                                        db=db,
-                                        charset="utf8mb4")
-
-        with sql_connector.cursor() as cursor:
-            ## 同id覆盖
-            query = "DELETE FROM event WHERE id=\"{}\"".format(doc["id"])
-            cursor.execute(query)
-            
-            self.mysql_count[industry] += 1
-            insert_query = "INSERT INTO `event` (`id`, `name`, `time`, `tags`, `content`) VALUES (%s, %s, %s, %s, %s)"
-            cursor.execute(insert_query , (doc["id"], doc["name"], doc["time"], doc['event_type'], doc["content"]))
-        
-        sql_connector.commit()
-        sql_connector.close()
+        industry, db = INDUSTRY_ROUTES[industry]
+        ## 同id覆盖由 ON DUPLICATE KEY UPDATE 完成
+        writer.add(db, (doc["id"], doc["name"], doc["time"], doc['event_type'], doc["content"]), industry)
 
 
     def process(self, date_str):
@@ -90,72 +105,91 @@ class NewsArango2mysql(object):
         next_date = datetime.datetime.strftime(next_date, "%Y-%m-%d")
 
         start_time = time.time()
+        metrics = JobMetrics("news_arango2mysql", date_str)
         ## 从arangodb获取需要同步的资讯
         arango_connector = ArangoConnection(arangoURL=ARANGO_URL,
                                             username=ARANGO_USER,
                                             password=ARANGO_PASSWD)
 
         arango_db = arango_connector[ARANGO_DB]
-        aql = "for x in {} FILTER x.update_time >= \"{}\" AND x.update_time <= \"{}\" RETURN x".format(ARANGO_COLLECTION, process_date, next_date)
-        results = []
-        try:
-            results = arango_db.fetch_list(aql)
-        except Exception as e:
-            logger.error("查询arangodb错误: " + str(e))
-        self.arango_count = len(results)
-
-        for result in tqdm(results):
-            doc = {}
-            doc["id"] = result["_key"]
-            doc["name"] = result["title"]
-            doc["time"] = result["publish_time"].split(" ")[0]
-            doc["url"] = result["url"]
-            doc["content"] = result["abstract"]
-            
-            industrys = []       ## 资讯的行业分类, 存在某个企业对应多个行业的情况
-            tags = result["tags"]
-            for tag in tags:
-                if tag["conceptName"] == "产业":
-                    industrys.append(tag["name"])
-                if tag["conceptName"] == "事件":
-                    doc["event_type"] = tag["name"]
-
-            ## 没有事件就不导入
-            if "event_type" not in doc:
-                continue
-            
+        reader = ArangoUpdateReader(arango_db, ARANGO_COLLECTION, READ_FIELDS)
+        ## 每个行业数据库一个连接和一个写入线程, 按块批量写入
+        writer = MysqlBulkWriter(MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWD, "event", EVENT_COLUMNS,
+                                 chunk_size=MYSQL_BULK_SIZE, metrics=metrics, parallel=True)
+
+        for result in tqdm(metrics.timed_iter("read", reader.read(process_date, next_date))):
+            doc, industrys = self.transform(result)
             ## 根据企业的行业分类，分别插入到不同的数据库中，一篇资讯可以插入多个表
-            industrys = list(set(industrys))
             for industry in industrys:
-                try:
-                    self.insert(doc, industry)
-                except Exception as e:
-                    logger.error(str(e))
-                    logger.info("插入错误, 资讯id: {}".format(doc["id"]))
+                self.insert(writer, doc, industry)
+
+        writer.close()
+        self.arango_count = reader.count
+        for industry in self.mysql_count:
+            self.mysql_count[industry] = writer.saved_count.get(industry, 0)
 
         end_time = time.time()
+        industry_counts = "".join("\n                        {}[{}]篇,".format(industry, count) for industry, count in self.mysql_count.items())
         logger.info('''本次同步日期: {}, 从arango导入mysql, 
-                        arango找到资讯[{}]篇, 
-                        人工智能[{}]篇,
-                        光电产业[{}]篇, 
-                        新能源汽车[{}]篇, 
-                        生物医药[{}]篇,
-                        地理信息[{}]篇,
-                        5G产业[{}]篇,
-                        同步耗时: {} 秒 '''.format(date_str,
-                                                 self.arango_count, 
-                                                 self.mysql_count["人工智能"], 
-                                                 self.mysql_count["光电产业"],
-                                                 self.mysql_count["新能源汽车"],
-                                                 self.mysql_count["生物医药"],
-                                                 self.mysql_count["地理信息"],
-                                                 self.mysql_count["5G产业"],
-                                                 int(end_time - start_time)))
+                        arango找到资讯[{}]篇, {}
+                        同步耗时: {} 秒 '''.format(date_str, self.arango_count, industry_counts, int(end_time - start_time)))
+
+        metrics.set_count("arango_count", self.arango_count)
+        for industry, count in self.mysql_count.items():
+            metrics.set_count("mysql_count_" + industry, count)
+        metrics.write()
+
+
+    ## 回填模式: 重新同步update_time在 [start_date, end_date] 内的全部资讯
+    ## 数据先写入各数据库的本地文件, 再用LOAD DATA导入临时表并合并到event表
+    def backfill(self, start_date, end_date):
+        logger.info("回填 {} 至 {} 的资讯, 从arangodb导入mysql".format(start_date, end_date))
+        next_date = datetime.datetime.strptime(end_date, "%Y-%m-%d") + datetime.timedelta(days=1)
+        next_date = datetime.datetime.strftime(next_date, "%Y-%m-%d")
+
+        start_time = time.time()
+        metrics = JobMetrics("news_arango2mysql_backfill", "{}_{}".format(start_date, end_date))
+        arango_connector = ArangoConnection(arangoURL=ARANGO_URL,
+                                            username=ARANGO_USER,
+                                            password=ARANGO_PASSWD)
+
+        arango_db = arango_connector[ARANGO_DB]
+        reader = ArangoUpdateReader(arango_db, ARANGO_COLLECTION, READ_FIELDS)
+        os.makedirs(BACKFILL_STAGING_DIR, exist_ok=True)
+        loader = MysqlStagingLoader(MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWD, "event", EVENT_COLUMNS,
+                                    staging_dir=BACKFILL_STAGING_DIR, metrics=metrics)
+
+        for result in tqdm(metrics.timed_iter("read", reader.read(start_date, next_date))):
+            doc, industrys = self.transform(result)
+            for industry in industrys:
+                self.insert(loader, doc, industry)
+        self.arango_count = reader.count
+        logger.info("arango找到资讯[{}]篇, 本地文件写入完成, 开始导入mysql".format(self.arango_count))
+
+        for db, (count, seconds) in loader.load().items():
+            logger.info("数据库 {} 导入 {} 行, 耗时 {} 秒, {} 行/秒".format(db, count, round(seconds, 1), int(count / seconds) if seconds else count))
+        for industry in self.mysql_count:
+            self.mysql_count[industry] = loader.saved_count.get(industry, 0)
+
+        end_time = time.time()
+        industry_counts = "".join("\n                        {}[{}]篇,".format(industry, count) for industry, count in self.mysql_count.items())
+        logger.info('''本次回填日期: {} 至 {}, 从arango导入mysql, 
+                        arango找到资讯[{}]篇, {}
+                        回填耗时: {} 秒 '''.format(start_date, end_date, self.arango_count, industry_counts, int(end_time - start_time)))
+
+        metrics.set_count("arango_count", self.arango_count)
+        for industry, count in self.mysql_count.items():
+            metrics.set_count("mysql_count_" + industry, count)
+        metrics.write()
+
 
 if __name__ == "__main__":
     news_arango2mysql = NewsArango2mysql()
 
-    if len(sys.argv) > 1:
+    ## 回填: python3 news_arango2mysql.py backfill 2020-01-01 2020-03-31
+    if len(sys.argv) > 3 and sys.argv[1] == "backfill":
+        news_arango2mysql.backfill(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 1:
         news_arango2mysql.process(sys.argv[1])
     else:
         raise Exception("请输入执行日期参数")
\ No newline at end of file
@@ -15,9 +15,15 @@ import requests
 import json
 import time
 import datetime
+import uuid
 from dateutil import parser
-import jieba
 from pyArango.connection import Connection as ArangoConnection
+from pipeline_client import PipelineClient
+from adaptive_batch import AdaptiveBatcher
+from job_metrics import JobMetrics
+from arango_reader import ArangoUpdateReader
+from arango_bulk import ArangoBulkWriter
+from fragment_window import ENTITY_THRESHOLD, TEXT_THRESHOLD, TOKENIZE_PROCESSES, FragmentWindow, Tokenizer, fingerprint
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,9 +34,24 @@ logger = logging.getLogger(__name__)
 ## 调用fragment pipeline地址以及批处理大小
 BATCH_SIZE = 20
 
-## 相似性阈值
-TEXT_THRESHOLD = 0.8
-ENTITY_THRESHOLD = 0.8
+## 自适应批处理: 每批资讯数上下限, 单批请求体字节数上限, 单批期望耗时(秒)
+BATCH_MIN_SIZE = 5
+BATCH_MAX_SIZE = 50
+BATCH_MAX_BYTES = 4 * 1024 * 1024
+BATCH_TARGET_LATENCY = 30
+
+## 批量写入kb_news_fragment的事件句数, 每批落盘一次
+FRAGMENT_BULK_SIZE = 500
+
+## 去重检查的发布时间窗口(天)
+DEDUP_WINDOW_DAYS = 7
+
+## 同时在途的fragment pipeline请求批次数, 为1时退化为逐批串行调用
+MAX_IN_FLIGHT = 4
+
+## 读取kb_news的游标空闲超时(秒); 一批游标数据要经过多次服务调用才能处理完, 需要较长的超时
+READ_CURSOR_TTL = 2 * 3600
+
 
 class FragmentPipeline(object):
 
@@ -41,24 +62,6 @@ class FragmentPipeline(object):
         self.duplicate_count = 0        # 重复事件数目
 
 
-    def text_similarity(self, sent_1, sent_2):
-        set_1 = set([word for word in jieba.cut(sent_1)])
-        set_2 = set([word for word in jieba.cut(sent_2)])
-        set_all = set_1 & set_2
-        return len(set_all) / min(len(set_1), len(set_2))
-
-    
-    def entity_similarity(self, entities_1, entities_2):
-        if not len(entities_1) or not len(entities_2):
-            return 0
-        
-        set_1 = set([entity["name"] for entity in entities_1])
-        set_2 = set([entity["name"] for entity in entities_2])
-        set_all = set_1 & set_2
-
-        return len(set_all) / min(len(set_1), len(set_2))
-
-
     ## 资讯处理主函数
     def process(self, date_str):
         
@@ -75,6 +78,7 @@ class FragmentPipeline(object):
         next_date = datetime.datetime.strftime(next_date, "%Y-%m-%d")
 
         start_time = time.time()
+        metrics = JobMetrics("news_fragment_pipeline", process_date)
 
         ## 从arangodb kb_news获取需要处理的资讯
         arango_connector = ArangoConnection(arangoURL=ARANGO_URL,
@@ -82,35 +86,65 @@ class FragmentPipeline(object):
                                             password=ARANGO_PASSWD)
 
         arango_db = arango_connector[ARANGO_DB]
-        source_collection = arango_db[SOURCE_COLLECTION]
-        target_collection = arango_db[TARGET_COLLECTION]
+        ## 资讯按update_time流式读取, 边读边调用服务; 整篇资讯发送给fragment pipeline, 不做字段投影
+        reader = ArangoUpdateReader(arango_db, SOURCE_COLLECTION, ttl=READ_CURSOR_TTL)
+        results = metrics.timed_iter("read", reader.read(process_date, next_date))
 
-        aql = "for x in {} FILTER x.update_time >= \"{}\" AND x.update_time <= \"{}\" RETURN x".format(SOURCE_COLLECTION, process_date, next_date)
-        results = arango_db.fetch_list(aql)
-
-        self.news_count = len(results)
-        logger.info("共找到资讯 {} 条".format(self.news_count))
+        ## 分词进程池在建立http连接池之前启动
+        tokenizer = Tokenizer(TOKENIZE_PROCESSES)
 
         logger.info("调用news fragment pipeline服务")
-        for i in range(0, self.news_count, BATCH_SIZE):
-            start = i
-            end = min(self.news_count, start + BATCH_SIZE)
+        ## 按请求体大小与服务耗时自适应分批, 调用失败的批次对半拆分重试
+        batcher = AdaptiveBatcher(BATCH_SIZE, BATCH_MIN_SIZE, BATCH_MAX_SIZE, BATCH_MAX_BYTES, BATCH_TARGET_LATENCY)
+        client = PipelineClient(FRAGMENT_PIPELINE_URL, pool_size=MAX_IN_FLIGHT, batcher=batcher, metrics=metrics)
+        ## 不重复的事件句缓存后批量写入, 每批落盘一次
+        ## 写入失败的事件句从去重窗口中移除
+        writer = ArangoBulkWriter(arango_db, TARGET_COLLECTION, chunk_size=FRAGMENT_BULK_SIZE,
+                                  wait_for_sync=True, on_error=lambda key, error: window.remove(key), metrics=metrics)
+        ## 近一周事件句去重窗口, 第一次检查时加载; 扩展窗口前先写入缓存的事件句, 保证库中数据完整
+        window = FragmentWindow(arango_db, TARGET_COLLECTION, TEXT_THRESHOLD, ENTITY_THRESHOLD,
+                                before_load=writer.flush, tokenizer=tokenizer)
+
+        ## 返回 (起始序号, 资讯批次), 供client.dispatch调用
+        def doc_batches():
+            end = 0
+            for doc_batch in batcher.batches(results):
+                yield end, doc_batch
+                end += len(doc_batch)
+
+        ## 服务返回结果后立即提交本批事件句分词, 并多取一批结果: 下一批在进程池分词的同时处理当前批次的去重、入库
+        def tokenized_batches(dispatched):
+            pending = None
+            for start, doc_batch, process_docs, elapsed in dispatched:
+                sections = [emf["section"] for process_doc in (process_docs or []) if process_doc is not None
+                            for emf in (process_doc.get("naf") or {}).get("emfs", [])]
+                current = (start, doc_batch, process_docs, elapsed, tokenizer.submit(sections), len(sections))
+                if pending is not None:
+                    yield pending
+                pending = current
+            if pending is not None:
+                yield pending
+
+        ## 后续批次的服务调用与当前批次的去重、入库同时进行, 最多MAX_IN_FLIGHT个批次在途
+        ## 结果按提交顺序处理, 去重结果与逐批串行调用时一致
+        dispatched = client.dispatch(doc_batches(), max_in_flight=MAX_IN_FLIGHT, ordered=True)
+        for start, doc_batch, process_docs, elapsed, token_result, section_count in tokenized_batches(dispatched):
+            end = start + len(doc_batch)
             batch_start_time = time.time()
 
-            doc_batch = results[start : end]
-
-            post_data = {
-                "documents": doc_batch,
-            }
-
-            response = requests.post(FRAGMENT_PIPELINE_URL, json.dumps(post_data))
-
-            if response.status_code == 200:
+            if process_docs is not None:
                 logger.info("fragment pipeline成功返回结果")
-                process_docs = response.json().get("body")
+
+                ## 等待本批分词完成(提交于处理上一批之前)
+                with metrics.stage("tokenize", docs=section_count):
+                    section_tokens = iter(token_result.get())
                 
                 ## 返回结果的处理与封装，导入目标arangodb数据库
                 for process_doc in process_docs:
+                    ## 拆分重试后仍失败的单篇资讯
+                    if process_doc is None:
+                        logger.error("资讯调用fragment pipeline服务失败, 跳过")
+                        continue
                     naf = process_doc.get("naf")
                     if "emfs" in naf:
                         ## 抽取出事件微文档的数量+1 
@@ -118,41 +152,28 @@ class FragmentPipeline(object):
 
                         for emf in naf["emfs"]:
                             ## 每次插入的时候检测近一周数据重复性: 1) section 短文本相似性; 2)事件类型与实体相似性
-                            duplicate_flag = False
+                            dedup_start_time = time.time()
                             
                             check_date = None           ## 检查重复数据的日期，检测一周以内的数据
                             check_date = datetime.datetime.strptime(naf["publish_time"], '%Y-%m-%d %H:%M:%S')
-                            check_date = check_date - datetime.timedelta(days=7)
+                            check_date = check_date - datetime.timedelta(days=DEDUP_WINDOW_DAYS)
                             check_date = datetime.datetime.strftime(check_date, "%Y-%m-%d")
 
                             sentence = emf["section"]
-                            event_type = emf["event_type"]
-                            entities = emf.get("entities", [])
-                            duplicate_aql = "FOR x in {} FILTER x.publish_time >= \"{}\" RETURN x".format(TARGET_COLLECTION, check_date)
-                            duplicate_results = []
-                            try:
-                                duplicate_results = arango_db.fetch_list(duplicate_aql)
-                            except:
-                                pass
-                            
-                            for duplicate_result in duplicate_results:
-                                ## 文本相似性
-                                if self.text_similarity(sentence, duplicate_result["section"]) > TEXT_THRESHOLD:
-                                    duplicate_flag = True
-                                    logger.info("该事件句: >>[{}]<<与数据库内事件句:>>[{}]<<文本相似, 过滤".format(sentence, duplicate_result["section"]))
-                                    break
-                                ## 事件类型与实体相似性
-                                if event_type == duplicate_result["event_type"] and self.entity_similarity(entities, duplicate_result.get("entities", [])) > ENTITY_THRESHOLD:
-                                    duplicate_flag = True
-                                    logger.info("该事件句: >>[{}]<<与数据库内事件句:>>[{}]<<实体相似, 过滤".format(sentence, duplicate_result["section"]))
-                                    break
+                            emf_fingerprint = fingerprint(sentence, [entity["name"] for entity in emf.get("entities", [])], next(section_tokens))
+                            duplicate = window.find_duplicate(emf_fingerprint, emf["event_type"], check_date)
+                            duplicate_flag = duplicate is not None
+                            if duplicate_flag:
+                                logger.info("该事件句: >>[{}]<<与数据库内事件句:>>[{}]<<{}相似, 过滤".format(sentence, duplicate[0], duplicate[1]))
 
+                            metrics.record("dedup", time.time() - dedup_start_time, 1)
                             if duplicate_flag:
                                 self.duplicate_count += 1
                                 continue
                             
                             ## 事件不重复则导入
                             doc = {}
+                            doc["_key"] = uuid.uuid4().hex          ## 指定_key, 写入失败时可以找到对应的事件句
                             doc["doc_id"] = naf["doc_id"]
                             doc["section"] = emf["section"]
                             doc["event_type"] = emf["event_type"]
@@ -161,22 +182,34 @@ class FragmentPipeline(object):
                             doc["event_date"] = emf["event_date"]
                             doc["publish_time"] = emf["publish_time"]
                             doc["title"] = naf["title"]
+                            doc["fingerprint"] = emf_fingerprint
                             doc["create_time"] = datetime.date.today().strftime("%Y-%m-%d %H:%M:%S")
                             doc["update_time"] = doc["create_time"]
-                            target_collection.createDocument(doc).save(waitForSync = True)
-                            self.fragment_count += 1
+                            ## 加入缓存即更新去重窗口, 同一批内的事件句之间也能去重
+                            writer.add(doc)
+                            window.insert(doc)
 
                 batch_end_time = time.time()
-                logger.info("第 {} - {} 条数据处理结束, 共耗时: {} 秒".format(start, end, int(batch_end_time - batch_start_time)))
+                logger.info("第 {} - {} 条数据处理结束, 调用服务耗时: {} 秒, 去重入库耗时: {} 秒".format(start, end, int(elapsed), int(batch_end_time - batch_start_time)))
             else:
                 logger.error("第 {} - {} 条数据处理失败".format(start, end))
 
+        self.news_count = reader.count
+        client.close()
+        tokenizer.close()
+        writer.flush()
+        self.fragment_count = writer.saved_count
+
         ## 输出处理结果
         end_time = time.time()
         logger.info("本次fragment pipeline处理完成，共耗时: {} 秒".format(int(end_time - start_time)))
         logger.info("其中kb_news库共 {} 条数据, pipeline共处理 {} 条数据, 导入kb_new_fragment {} 条数据, 重复事件 {} 条"
                     .format(self.news_count, self.pipeline_count, self.fragment_count, self.duplicate_count))
 
+        for name in ["news_count", "pipeline_count", "fragment_count", "duplicate_count"]:
+            metrics.set_count(name, getattr(self, name))
+        metrics.write()
+
 
 
 if __name__ == '__main__':
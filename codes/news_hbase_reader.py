@@ -0,0 +1,109 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : news_hbase_reader.py
+# Description  : 资讯hbase表查询；按concept_id与采集日期区间 [start_date, end_date) 生成rowkey扫描区间,
+#                按天切分的各区间(加盐时每个分桶)并行扫描, 只读取需要的列, 解压解码后逐条返回资讯
+#                命令行: python3 news_hbase_reader.py <concept_id> <start_date> <end_date> [字段,字段...]
+#******************************************************************************
+
+import sys
+import json
+import logging
+import happybase
+from hbase_codec import COMPRESS_COLUMNS, codec_column, decode_row
+from hbase_rowkey import SALT_BUCKETS, date_ranges, parse_rowkey, parallel_scan
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+##导入Hbase
+
+## 资讯字段 -> hbase列, 与news_arango2hbase写入的列一致
+FIELD_COLUMNS = {
+    "html":         b"raw:html",
+    "concept_id":   b"info:concept_id",
+    "doc_id":       b"info:doc_id",
+    "title":        b"info:title",
+    "content":      b"info:content",
+    "url":          b"info:url",
+    "abstract":     b"info:abstract",
+    "source":       b"info:source",
+    "img_url":      b"info:img_url",
+    "tags":         b"info:tags",
+    "entities":     b"info:entities",
+    "publish_time": b"info:publish_time",
+    "insert_time":  b"info:insert_time",
+}
+
+## 以json写入的字段
+JSON_FIELDS = ["img_url", "tags", "entities"]
+
+## 扫描每次拉取的行数: 读取html时行较大, 拉取行数少一些; 不读html时一次多拉取, 减少往返
+SCAN_BATCH_SIZE = 200
+SCAN_BATCH_SIZE_NO_HTML = 1000
+
+## 连接池大小, 即同时扫描的区间数上限
+SCAN_POOL_SIZE = 8
+
+
+## 按concept_id与采集日期区间读取资讯, 返回 {"_key", "create_date", 字段...}
+## 结果按扫描到达的顺序返回, 不保证按rowkey排序; 盐值分桶数默认与写入时共用hbase_rowkey.SALT_BUCKETS
+class NewsHBaseReader(object):
+
+    def __init__(self, host, port, table_name, buckets=SALT_BUCKETS, pool_size=SCAN_POOL_SIZE):
+        self.table_name = table_name
+        self.buckets = buckets
+        self.pool_size = pool_size
+        self.pool = happybase.ConnectionPool(size=pool_size, host=host, port=port)
+        self.count = 0                  ## 已读取的资讯数
+
+
+    ## 需要读取的列, 压缩过的列同时读取压缩方式标记列; fields为空时读取全部列
+    def columns(self, fields):
+        if not fields:
+            return None
+        columns = []
+        for field in fields:
+            if field not in FIELD_COLUMNS:
+                raise ValueError("未知的资讯字段: {}".format(field))
+            column = FIELD_COLUMNS[field]
+            columns.append(column)
+            if column in COMPRESS_COLUMNS:
+                columns.append(codec_column(column))
+        return columns
+
+
+    def decode(self, rowkey, data):
+        concept_id, create_date, key = parse_rowkey(rowkey, self.buckets)
+        doc = {"_key": key, "create_date": create_date}
+        data = decode_row(data)
+        for field, column in FIELD_COLUMNS.items():
+            if column not in data:
+                continue
+            value = data[column].decode("utf-8")
+            doc[field] = json.loads(value) if field in JSON_FIELDS else value
+        return doc
+
+
+    ## concept_ids可以是单个concept_id或列表, 每个concept_id、盐值分桶、采集日期一个区间, 由连接池大小的线程并行扫描
+    def read(self, concept_ids, start_date, end_date, fields=None):
+        if isinstance(concept_ids, str):
+            concept_ids = [concept_ids]
+        ranges = [scan_range for concept_id in concept_ids for scan_range in date_ranges(concept_id, start_date, end_date, self.buckets)]
+        batch_size = SCAN_BATCH_SIZE if not fields or "html" in fields else SCAN_BATCH_SIZE_NO_HTML
+
+        for rowkey, data in parallel_scan(self.pool, self.table_name, ranges, self.columns(fields), batch_size, threads=self.pool_size):
+            self.count += 1
+            yield self.decode(rowkey, data)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        fields = sys.argv[4].split(",") if len(sys.argv) > 4 else None
+        reader = NewsHBaseReader(HBASE_HOST, HBASE_PORT, HBASE_TABLE)
+        for doc in reader.read(sys.argv[1], sys.argv[2], sys.argv[3], fields):
+            sys.stdout.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        logger.info("共读取资讯 {} 条".format(reader.count))
+    else:
+        raise Exception("用法: python3 news_hbase_reader.py <concept_id> <start_date> <end_date> [字段,字段...]")
@@ -16,11 +16,16 @@ from pymongo import MongoClient
 from dateutil import parser
 import datetime
 from bson.objectid import ObjectId
+from job_checkpoint import JobCheckpoint, MONGO_RESUME_SORT, mongo_position, mongo_resume_query
+from job_metrics import JobMetrics
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
+## 每处理多少条资讯写入一次断点
+CHECKPOINT_INTERVAL = 500
+
 
 
 
@@ -70,6 +75,7 @@ class NewsPartition(object):
             date_str = (datetime.date.today() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
         
         logger.info("执行采集日期为: {} 的资讯的清洗与分库".format(date_str))
+        metrics = JobMetrics("news_partition", date_str)
         process_date = datetime.datetime.strptime(date_str, "%Y-%m-%d")
         next_date = process_date + datetime.timedelta(days=1)
 
@@ -79,10 +85,25 @@ class NewsPartition(object):
         source_db = connector[SOURCE_DB]
         source_collection = source_db[SOURCE_COLLECTION]
         target_db = connector[TARGET_DB]
-        ## 查找某一天区间的资讯, 目前只处理微信公众号
-        docs = source_collection.find({"source": "公众号", "crawl_time": {"$gte": process_date, "$lte": next_date}})
 
-        for doc in docs:
+        ## 断点续跑: 按 (crawl_time, _id) 顺序读取, 从最后处理完的资讯之后继续
+        checkpoint = JobCheckpoint("news_partition", date_str)
+        source_count = checkpoint.get("source_count", 0)
+        target_count = checkpoint.get("target_count", 0)
+        position = checkpoint.get("position")
+
+        ## 排序与续跑的范围查询需要 (crawl_time, _id) 索引, 否则按天在内存中排序会超过排序内存上限; 索引已存在时不重复创建
+        source_collection.create_index(MONGO_RESUME_SORT, background=True)
+
+        ## 查找某一天区间的资讯, 目前只处理微信公众号
+        query = {"source": "公众号", "crawl_time": {"$gte": process_date, "$lte": next_date}}
+        docs = source_collection.find(mongo_resume_query(query, position)).sort(MONGO_RESUME_SORT)
+
+        for doc in metrics.timed_iter("read", docs):
+            ## 上一条资讯已处理完, 记录断点
+            if source_count and source_count % CHECKPOINT_INTERVAL == 0:
+                checkpoint.save(source_count=source_count, target_count=target_count, position=position)
+            position = mongo_position(doc)
             source_count += 1
             if ("content" not in doc) or (not doc["content"]):
                 logger.info("跳过资讯[{}], 原因: content内容为空".format(str(doc["_id"])))
@@ -92,7 +113,8 @@ class NewsPartition(object):
                 continue
             
             try:
-                publish_time = self.datetime_formatter(doc["publish_time"])
+                with metrics.stage("transform", docs=1):
+                    publish_time = self.datetime_formatter(doc["publish_time"])
             except Exception as e:
                 logger.error("日期格式化出错, 资讯ID {}".format(str(doc["_id"])))
                 continue
@@ -104,15 +126,19 @@ class NewsPartition(object):
             target_collection_name = TARGET_PREFIX + datetime.datetime.strftime(doc["crawl_time"], "%Y%m")
             target_collection = target_db[target_collection_name]
 
+            ## 索引与news_pipeline的读取顺序一致, 续跑的范围查询与排序都走索引
             if target_collection_name not in target_db.collection_names():
-                target_collection.create_index([('crawl_time', pymongo.ASCENDING)])
+                target_collection.create_index(MONGO_RESUME_SORT)
 
             ## 考虑同id覆盖
-            if target_collection.find_one_and_delete({"_id": ObjectId(doc["_id"])}):
-                logger.info("覆盖原数据: {}".format(str(doc["_id"])))
-            target_collection.insert_one(doc)
+            with metrics.stage("write", docs=1):
+                if target_collection.find_one_and_delete({"_id": ObjectId(doc["_id"])}):
+                    logger.info("覆盖原数据: {}".format(str(doc["_id"])))
+                target_collection.insert_one(doc)
             target_count += 1
 
+        checkpoint.complete(source_count=source_count, target_count=target_count, position=position)
+
         end_time = time.time()
         logger.info("完成采集日期为: {} 的资讯清洗分库, 其中采集库有 {} 条, 导入 [{}] 清洗库 {} 条, 耗时: {}秒"
                         .format(str(process_date), 
@@ -121,6 +147,10 @@ class NewsPartition(object):
                                 target_count,
                                 int(end_time - start_time)))
 
+        metrics.set_count("source_count", source_count)
+        metrics.set_count("target_count", target_count)
+        metrics.write()
+
 
 if __name__ == '__main__':
     news_partition = NewsPartition()
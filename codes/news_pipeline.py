@@ -19,6 +19,12 @@ from dateutil import parser
 import pymysql
 from pymongo import MongoClient
 from pyArango.connection import Connection as ArangoConnection
+from pipeline_client import PipelineClient
+from arango_bulk import ArangoBulkWriter
+from job_checkpoint import JobCheckpoint, MONGO_RESUME_SORT, mongo_position, mongo_resume_query
+from nlp_cache import NlpResultCache
+from adaptive_batch import AdaptiveBatcher
+from job_metrics import JobMetrics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -32,36 +38,365 @@ logger = logging.getLogger(__name__)
 ## 调用news pipeline地址以及批处理大小
 BATCH_SIZE = 20
 
+## 自适应批处理: 每批资讯数上下限, 单批请求体字节数上限, 单批期望耗时(秒)
+BATCH_MIN_SIZE = 5
+BATCH_MAX_SIZE = 50
+BATCH_MAX_BYTES = 4 * 1024 * 1024
+BATCH_TARGET_LATENCY = 30
+
+## mongodb游标每次拉取的资讯数
+MONGO_CURSOR_BATCH_SIZE = 200
+
+## 组装naf需要从mongodb读取的字段
+NAF_FIELDS = ["source", "search_key", "url", "title", "publish_time", "crawl_time", "content", "html", "img_url"]
+
+## 同时在途的news pipeline请求批次数, 为1时退化为逐批串行调用
+MAX_IN_FLIGHT = 4
+
+PIPELINE_CONFIG = {
+    "name": "资讯标注PIPELINE",
+    "components": [
+        "title_filter",                 ## 行业资讯标题过滤
+        "deduplicate",                  ## 去重
+        "company_link",                 ## 企业名链接
+        "topic_classify",               ## 资讯主题分类
+        "abstract_extract",             ## 资讯摘要抽取
+        "sentiment_classify"            ## 情感分析
+    ]
+}
+
+## 批量写入kb_news的文档数
+ARANGO_BULK_SIZE = 500
+
+## 每处理多少个批次写入一次断点
+CHECKPOINT_INTERVAL = 25
+
 ## 相似内容判断阈值
 THRESHOLD = 0.8
 
-class NewsPipeline(object):
+## 去重索引开始时加载的发布时间窗口(天); 发布时间更早的资讯去重时按需向前扩展窗口
+DEDUP_WINDOW_DAYS = 30
+
+## 相似判断的发布时间差(天), 差值的天数大于该值时不相似
+DEDUP_DATE_DIFF_DAYS = 10
+
+
+## kb_news近期资讯的标题去重索引, 每次运行开始时加载一次, 遇到发布时间更早的资讯时再向前补充加载
+## 按 (首个实体名, 标签名) 分块, 保存预先计算好的标题字集合与发布时间, 新资讯入库时同步更新
+class NewsDedupIndex(object):
 
     def __init__(self):
-        self.news_count = 0         #资讯采集总数
-        self.pipeline_count = 0     #经过nlp pipeline的资讯数
-        self.arango_count = 0       #存入arango的资讯数
-        self.duplicate_count = 0    #重复的资讯数
-        self.ignore_count = 0       #过滤的无关资讯
+        self.blocks = {}            ## (企业名, 标签名) -> {_key: entry}
+        self.block_keys = {}        ## _key -> 该资讯所在的分块, 用于同id覆盖时移除旧数据
+        self.arango_db = None
+        self.before_load = None     ## 补充加载前的回调, 用于先写入缓存中尚未入库的资讯
+        self.since = None           ## 已加载的最早发布日期, None表示尚未加载
+
+
+    ## 保证发布时间不早于since的资讯都已加载, 只取去重需要的字段, 已加载过的日期范围不再重复查询
+    def load(self, arango_db, since, before_load=None):
+        self.arango_db = arango_db
+        self.before_load = before_load or self.before_load
+        if self.since is not None and since >= self.since:
+            return
+
+        aql_filter = "x.publish_time >= @since AND LENGTH(x.entities) > 0"
+        bind_vars = {"@collection": ARANGO_COLLECTION, "since": since}
+        if self.since is not None:
+            aql_filter += " AND x.publish_time < @until"
+            bind_vars["until"] = self.since
+            if self.before_load:
+                self.before_load()
+        aql = """FOR x IN @@collection
+                    FILTER {}
+                    RETURN {{_key: x._key, title: x.title, publish_time: x.publish_time,
+                            company_name: x.entities[0].name, tag_names: x.tags[*].name}}""".format(aql_filter)
+        query = arango_db.AQLQuery(aql, bindVars=bind_vars, batchSize=1000, rawResults=True)
+        count = 0
+        for result in query:
+            if self.add(result["_key"], result["title"], result["publish_time"], result["company_name"], result["tag_names"] or []):
+                count += 1
+
+        self.since = since
+        logger.info("去重索引加载发布时间 >= {} 的资讯 {} 篇, 索引共 {} 篇资讯, {} 个分块".format(
+            since, count, len(self.block_keys), len(self.blocks)))
+
+
+    ## 标题与发布时间转为索引条目, 标题为空或发布时间格式不对时返回None
+    def make_entry(self, title, publish_time):
+        try:
+            return {
+                "title": title,
+                "title_set": set(title),
+                "publish_date": datetime.datetime.strptime(publish_time, "%Y-%m-%d %H:%M:%S")
+            }
+        except (TypeError, ValueError):
+            return None
+
+
+    ## 加入索引, 标题或发布时间无效时记录日志后跳过, 返回是否加入
+    def add(self, key, title, publish_time, company_name, tag_names):
+        self.remove(key)
+        entry = self.make_entry(title, publish_time)
+        if entry is None:
+            logger.warning("去重索引跳过资讯: {}, 标题: {}, 发布时间: {}".format(key, title, publish_time))
+            return False
+        block_names = set((company_name, tag_name) for tag_name in tag_names)
+        for block_name in block_names:
+            self.blocks.setdefault(block_name, {})[key] = entry
+        self.block_keys[key] = block_names
+        return True
+
 
+    def remove(self, key):
+        for block_name in self.block_keys.pop(key, ()):
+            self.blocks[block_name].pop(key, None)
 
-    ## 两篇文章相似度计算
-    def similarity(self, doc_1, doc_2):
+
+    ## 两篇文章相似度计算, entry_1为库内资讯, entry_2为新资讯
+    def similarity(self, entry_1, entry_2):
         ## 发布时间判断
-        date_1 = datetime.datetime.strptime(doc_1["publish_time"], "%Y-%m-%d %H:%M:%S")
-        date_2 = datetime.datetime.strptime(doc_2["publish_time"], "%Y-%m-%d %H:%M:%S")
-        date_diff = date_2 - date_1
+        date_diff = entry_2["publish_date"] - entry_1["publish_date"]
         ## 发布时间差一个月，基本认定不重复(即时重复在news pipeline中也有去重组件)
-        if date_diff.days > 10:
+        if date_diff.days > DEDUP_DATE_DIFF_DAYS:
+            return 0
+
+        set_1 = entry_1["title_set"]
+        set_2 = entry_2["title_set"]
+        if not set_1 or not set_2:
             return 0
-        
-        set_1 = set(doc_1["title"])
-        set_2 = set(doc_2["title"])
 
         score = len((set_1 & set_2)) / (min(len(set_1), len(set_2)))
         return score
 
 
+    ## 查找与doc相似的库内资讯, 返回其标题, 不相似或无法比较时返回None
+    def find_duplicate(self, doc, company_name, event_type):
+        entry = self.make_entry(doc["title"], doc["publish_time"])
+        if entry is None:
+            logger.warning("资讯标题或发布时间无效, 不去重: {}".format(doc["_key"]))
+            return None
+
+        ## 发布时间早于窗口的资讯, 先把窗口扩展到可能与它相似的最早发布日期
+        if self.arango_db is not None:
+            since = entry["publish_date"] - datetime.timedelta(days=DEDUP_DATE_DIFF_DAYS + 1)
+            self.load(self.arango_db, since.strftime("%Y-%m-%d"))
+
+        block = self.blocks.get((company_name, event_type))
+        if not block:
+            return None
+
+        for key, result in block.items():
+            ## 同id覆盖的资讯不参与比较
+            if key == doc["_key"]:
+                continue
+            if self.similarity(result, entry) > THRESHOLD:
+                return result["title"]
+        return None
+
+
+class NewsPipeline(object):
+
+    def __init__(self):
+        self.news_count = 0         #资讯采集总数
+        self.pipeline_count = 0     #经过nlp pipeline的资讯数
+        self.arango_count = 0       #存入arango的资讯数
+        self.duplicate_count = 0    #重复的资讯数
+        self.ignore_count = 0       #过滤的无关资讯
+        self.dedup_index = NewsDedupIndex()     #kb_news标题去重索引
+        self.read_positions = {}    #已读取、尚未分批的资讯 doc_id -> 断点位置
+        self.batch_positions = {}   #批次结束序号 -> 批次最后一条资讯的断点位置
+        self.metrics = JobMetrics("news_pipeline")   #分阶段耗时统计
+
+
+    def save_checkpoint(self, checkpoint, done_count, position, completed=False):
+        values = {
+            "done_count": done_count,
+            "position": position,
+            "pipeline_count": self.pipeline_count,
+            "ignore_count": self.ignore_count,
+            "duplicate_count": self.duplicate_count,
+            "arango_count": self.arango_count
+        }
+        if completed:
+            checkpoint.complete(**values)
+        else:
+            checkpoint.save(**values)
+
+
+    ## 从mongodb游标流式读取资讯, 组装成naf结构, 由batcher分批返回 (起始序号, naf批次)
+    ## 按 (crawl_time, _id) 索引顺序读取, 断点续跑时从position之后读取, 序号从skip开始
+    ## 每个批次最后一条资讯的断点位置按批次结束序号记录在batch_positions中
+    def iter_naf_batches(self, news_collection, query, batcher, skip=0, position=None):
+        index = skip
+        for naf_batch in batcher.batches(self.iter_nafs(news_collection, query, position)):
+            index += len(naf_batch)
+            self.batch_positions[index] = self.read_positions[naf_batch[-1]["metadata"]["doc_id"]]
+            for naf in naf_batch:
+                self.read_positions.pop(naf["metadata"]["doc_id"], None)
+            yield index - len(naf_batch), naf_batch
+
+
+    def iter_nafs(self, news_collection, query, position=None):
+        docs = news_collection.find(mongo_resume_query(query, position), projection=NAF_FIELDS)
+        docs = docs.sort(MONGO_RESUME_SORT).batch_size(MONGO_CURSOR_BATCH_SIZE)
+
+        for doc in self.metrics.timed_iter("read", docs):
+            self.news_count += 1
+
+            naf = {}
+            metadata = {}
+            metadata["doc_id"] = str(doc["_id"])
+            self.read_positions[metadata["doc_id"]] = mongo_position(doc)
+            metadata["source"] = doc["source"]
+            metadata["search_key"] = doc["search_key"]                 ## 用于来源于公众号的资讯带企业名称
+            metadata["url"] = doc["url"]
+            metadata["title"] = doc["title"]
+            metadata["publish_time"] = doc["publish_time"]
+            metadata["crawl_time"] = doc["crawl_time"].strftime("%Y-%m-%d %H:%M:%S")
+            metadata["content"] = doc["content"]
+            metadata["html"] = doc["html"]
+            metadata["img_url"] = doc["img_url"]
+            naf["metadata"] = metadata
+            yield naf
+
+
+    ## 查询nlp结果缓存, 只把未命中的资讯发送给news pipeline服务
+    ## 返回 ((起始序号, naf批次, 缓存key, 命中结果), 未命中的naf), 供client.dispatch调用
+    def iter_uncached_batches(self, batches, cache):
+        components = PIPELINE_CONFIG["components"]
+        for index, naf_batch in batches:
+            keys = [cache.make_key(naf["metadata"], components) for naf in naf_batch]
+            with self.metrics.stage("cache", docs=len(keys)):
+                cached = cache.get_many(keys)
+            misses = [naf for naf, key in zip(naf_batch, keys) if key not in cached]
+            yield (index, naf_batch, keys, cached), misses
+
+
+    ## 按原顺序合并缓存结果与服务返回结果, 服务返回的结果写入缓存
+    ## 缓存中不保存正文与html, 命中时资讯元数据以本次读取的为准
+    ## 服务返回的结果数与发送的资讯数不一致时, 缺少结果的资讯按处理失败(None)处理
+    def merge_cached(self, naf_batch, keys, cached, process_naf_list, cache):
+        miss_count = len([key for key in keys if key not in cached])
+        process_naf_list = list(process_naf_list or [])
+        if len(process_naf_list) != miss_count:
+            logger.error("news pipeline返回结果数 {} 与发送的资讯数 {} 不一致".format(len(process_naf_list), miss_count))
+            process_naf_list = (process_naf_list + [None] * miss_count)[ : miss_count]
+        service_results = iter(process_naf_list)
+        merged = []
+        new_items = []
+        for naf, key in zip(naf_batch, keys):
+            if key in cached:
+                process_naf = cached[key]
+                if process_naf.get("naf"):
+                    process_naf["naf"]["metadata"].update(naf["metadata"])
+            else:
+                process_naf = next(service_results)
+                if process_naf is not None:
+                    cache_naf = dict(process_naf)
+                    if cache_naf.get("naf"):
+                        cache_naf["naf"] = dict(cache_naf["naf"])
+                        cache_naf["naf"]["metadata"] = {k: v for k, v in cache_naf["naf"]["metadata"].items() if k not in ("content", "html")}
+                    new_items.append((key, cache_naf))
+            merged.append(process_naf)
+
+        cache.put_many(new_items)
+        return merged
+
+
+    ## 一个批次的news pipeline返回结果去重后导入arangodb, 计数记在该批次的counts中, 加入writer的_key记录在written中
+    def save_batch(self, index, naf_batch, process_naf_list, writer, counts, written):
+        counts["pipeline_count"] += len([process_naf for process_naf in process_naf_list if process_naf is not None])
+
+        for i, process_naf in enumerate(process_naf_list):
+            ## 拆分重试后仍失败的单篇资讯
+            if process_naf is None:
+                logger.error("资讯处理失败, doc_id=[{}], title=[{}]"
+                             .format(naf_batch[i]["metadata"]["doc_id"], naf_batch[i]["metadata"]["title"]))
+                continue
+
+            naf = process_naf.get("naf")
+            messages = process_naf.get("messages")              ## 返回的messages为数组，带有每个组件的处理标志
+
+            if not naf:
+                message = " ".join([message for message in messages if message])
+                logger.info("资讯被过滤, doc_id=[{}], title=[{}], 原因=[{}]"
+                            .format(naf_batch[i]["metadata"]["doc_id"], naf_batch[i]["metadata"]["title"], message))
+                if "标题含有过滤词" in message:
+                    counts["ignore_count"] += 1
+                elif "找到相同资讯" in message:
+                    counts["duplicate_count"] += 1
+                continue
+
+            ## 同id覆盖问题: 入库时按_key覆盖, 不入库时删除旧数据
+            _id = naf["metadata"]["doc_id"]
+            self.dedup_index.remove(_id)
+
+            ## naf 结构转化为arangodb存储的数据格式
+            doc = {}
+            doc["_key"] = naf["metadata"]["doc_id"]
+            doc["name"] = naf["metadata"]["title"]
+            doc["create_time"] = naf["metadata"]["crawl_time"]          ## 采集时间变为create_time
+            doc["update_time"] = doc["create_time"]
+
+            ## 基本属性
+            # doc["doc_id"] = naf["metadata"]["doc_id"]
+            doc["title"] = naf["metadata"]["title"]
+            doc["content"] = naf["metadata"]["content"]
+            doc["abstract"] = naf["metadata"]["abstract"]
+            doc["url"] = naf["metadata"]["url"]
+            doc["html"] = naf["metadata"]["html"]
+            doc["img_url"] = naf["metadata"]["img_url"]
+            doc["publish_time"] = naf["metadata"]["publish_time"]
+            doc["source"] = naf["metadata"]["source"]
+
+            ## 标签
+            if "tags" not in naf or len(naf["tags"]) == 0:
+                logger.info("该资讯无标签: {}".format(doc["_key"]))
+                writer.remove(_id)
+                continue
+            tags = naf["tags"]
+            doc["tags"] = tags
+
+            ## 实体
+            if "entities" not in naf or len(naf["entities"]) == 0:
+                logger.info("该资讯中无关联企业: {}".format(doc["_key"]))
+                writer.remove(_id)
+                continue
+            entities = naf.get("entities")
+            doc["entities"] = entities
+
+            ## 去重以及插入
+            duplicate = False
+            company_name = doc["entities"][0]["name"]
+            event_type = ""
+            for tag in naf["tags"]:
+                if tag["conceptName"] == "事件":
+                    event_type = tag["name"]
+
+            try:
+                with self.metrics.stage("dedup", docs=1):
+                    duplicate_title = self.dedup_index.find_duplicate(doc, company_name, event_type)
+                if duplicate_title:
+                    logger.info("两篇文章比较: {} ^^^^^ {}, 比较结果: 相似".format(duplicate_title, doc["title"]))
+                    duplicate = True
+            except Exception as e:
+                logger.error(str(e))
+
+            ## 重复就不插入
+            if duplicate:
+                logger.info("该文章与数据库内文章相似")
+                writer.remove(_id)
+                continue
+
+            ## 批量写入, 写入失败时由writer回调从去重索引中移除并扣除计数
+            counts["arango_count"] += 1
+            written[doc["_key"]] = index
+            writer.add(doc)
+            self.dedup_index.add(doc["_key"], doc["title"], doc["publish_time"], company_name,
+                                 [tag["name"] for tag in tags])
+
+
     ## 资讯处理主函数
     def process(self, date_str):
         
@@ -73,6 +408,7 @@ class NewsPipeline(object):
             date_str = (datetime.date.today() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
         
         logger.info("执行采集时间为: {} 的资讯标注news pipeline".format(date_str))
+        self.metrics = JobMetrics("news_pipeline", date_str)
         process_date = datetime.datetime.strptime(date_str, "%Y-%m-%d")
         next_date = process_date + datetime.timedelta(days=1)
   
@@ -84,173 +420,101 @@ class NewsPipeline(object):
         admin_db = mongo_client["admin"]
         admin_db.authenticate(MONGO_USER, MONGO_PASSWD)
         news_collection = mongo_client[MONGO_NEWS_DB][collection_name]
-
-        ## 只处理公众号资讯
-        docs = news_collection.find({"source": "公众号", "crawl_time": {"$gte": process_date, "$lte": next_date}})
-        self.news_count = docs.count()
-        logger.info("采集时间为: {}, 从表: {} 共找到资讯 {} 条".format(date_str, collection_name, self.news_count))
-
-        ##组装naf结构
-        naf_list = []
-        for doc in docs:
-            naf = {}
-            metadata = {}
-            metadata["doc_id"] = str(doc["_id"])
-            metadata["source"] = doc["source"]
-            metadata["search_key"] = doc["search_key"]                 ## 用于来源于公众号的资讯带企业名称
-            metadata["url"] = doc["url"]
-            metadata["title"] = doc["title"]
-            metadata["publish_time"] = doc["publish_time"]
-            metadata["crawl_time"] = doc["crawl_time"].strftime("%Y-%m-%d %H:%M:%S")
-            metadata["content"] = doc["content"]
-            metadata["html"] = doc["html"]
-            metadata["img_url"] = doc["img_url"]
-            naf["metadata"] = metadata
-            naf_list.append(naf)
-
-        logger.info("资讯组装成naf结构, 调用news pipeline接口服务")
-
-        ## news pipeline服务处理
-        index = 0
-        while index < len(naf_list):
-            batch_start_time = time.time()
-
-            ## 每次取batch大小的数据
-            end = len(naf_list) if (index + BATCH_SIZE > len(naf_list)) else index + BATCH_SIZE
-            naf_batch = naf_list[index : end]
-
-            post_data = {
-                "documents": naf_batch,
-                "config": {
-                    "name": "资讯标注PIPELINE",
-                    "components": [
-                        "title_filter",                 ## 行业资讯标题过滤
-                        "deduplicate",                  ## 去重
-                        "company_link",                 ## 企业名链接
-                        "topic_classify",               ## 资讯主题分类
-                        "abstract_extract",             ## 资讯摘要抽取
-                        "sentiment_classify"            ## 情感分析
-                    ]                       
-                }
-            }
-
-            response = requests.post(NEWS_PIPELINE_URL, json.dumps(post_data))
-            if response.status_code == 200:
-                logger.info("news pipeline返回结果")
-                process_naf_list = response.json().get("body")
-                self.pipeline_count += len(process_naf_list)
-
-                ##插入arangodb
-                arango_connector = ArangoConnection(arangoURL=ARANGO_URL,
-                                                    username=ARANGO_USER,
-                                                    password=ARANGO_PASSWD)
-
-                arango_db = arango_connector[ARANGO_DB]
-                arango_collection = arango_db[ARANGO_COLLECTION]
-
-                for i, process_naf in enumerate(process_naf_list):
-                    naf = process_naf.get("naf")
-                    messages = process_naf.get("messages")              ## 返回的messages为数组，带有每个组件的处理标志
-
-                    if not naf:
-                        message = " ".join([message for message in messages if message])
-                        logger.info("资讯被过滤, doc_id=[{}], title=[{}], 原因=[{}]"
-                                    .format(naf_batch[i]["metadata"]["doc_id"], naf_batch[i]["metadata"]["title"], message))
-                        if "标题含有过滤词" in message:
-                            self.ignore_count += 1
-                        elif "找到相同资讯" in message:
-                            self.duplicate_count += 1
-
-                    else:
-                        ## 同id覆盖问题
-                        _id = naf["metadata"]["doc_id"]
-                        try:
-                            doc = arango_collection[_id]
-                            doc.delete()
-                            logger.info("资讯覆盖, id: {}".format(_id))
-                        except:
-                            pass
-
-                        ## naf 结构转化为arangodb存储的数据格式
-                        doc = {}
-                        doc["_key"] = naf["metadata"]["doc_id"]
-                        doc["name"] = naf["metadata"]["title"]
-                        doc["create_time"] = naf["metadata"]["crawl_time"]          ## 采集时间变为create_time
-                        doc["update_time"] = doc["create_time"]
-                        
-                        ## 基本属性
-                        # doc["doc_id"] = naf["metadata"]["doc_id"]
-                        doc["title"] = naf["metadata"]["title"]
-                        doc["content"] = naf["metadata"]["content"]
-                        doc["abstract"] = naf["metadata"]["abstract"]
-                        doc["url"] = naf["metadata"]["url"]
-                        doc["html"] = naf["metadata"]["html"]
-                        doc["img_url"] = naf["metadata"]["img_url"]
-                        doc["publish_time"] = naf["metadata"]["publish_time"]
-                        doc["source"] = naf["metadata"]["source"]
-
-                        ## 标签
-                        if "tags" not in naf or len(naf["tags"]) == 0:
-                            logger.info("该资讯无标签: {}".format(doc["_key"]))
-                            continue
-                        tags = naf["tags"]
-                        doc["tags"] = tags
-                        
-                        ## 实体
-                        if "entities" not in naf or len(naf["entities"]) == 0:
-                            logger.info("该资讯中无关联企业: {}".format(doc["_key"]))
-                            continue
-                        entities = naf.get("entities")
-                        doc["entities"] = entities
-
-                        ## 去重以及插入
-                        duplicate = False
-                        company_name = doc["entities"][0]["name"]
-                        event_type = ""
-                        for tag in naf["tags"]:
-                            if tag["conceptName"] == "事件":
-                                event_type = tag["name"]
-
-                        try:
-                            aql = "FOR x IN {} FILTER x.entities[0].name == \"{}\" RETURN x".format(ARANGO_COLLECTION, company_name)
-                            results = arango_db.fetch_list(aql)
-                            for result in results:
-                                for tag in result["tags"]:
-                                    ## 相同事件类型才判断是否相似
-                                    if tag["name"] == event_type:
-                                        logger.info("两篇文章比较: {} ^^^^^ {}".format(result["title"], doc["title"]))
-                                        score = self.similarity(result, doc)
-                                        if score > THRESHOLD:
-                                            logger.info("比较结果: 相似")
-                                            duplicate = True
-                                        else:
-                                            logger.info("比较结果：不相似")
-                        except Exception as e:
-                            logger.error(str(e))
-                        
-                        ## 重复就不插入
-                        if duplicate:
-                            logger.info("该文章与数据库内文章相似")
-                            continue
-
-                        try:
-                            arango_collection.createDocument(doc).save()
-                            self.arango_count += 1
-                        except Exception as e:
-                            logger.error("插入arangodb出错, 文档id: {}".format(doc["_key"]))
-
-                batch_end_time = time.time()
-                logger.info("第 {} - {} 条数据处理结束, 共耗时: {} 秒".format(index, end, int(batch_end_time - batch_start_time)))
-            else:
+        ## 本次改动之前建的月表只有crawl_time索引, 补建 (crawl_time, _id) 索引, 排序不在内存中进行
+        news_collection.create_index(MONGO_RESUME_SORT, background=True)
+
+        ## 断点续跑: 从最后连续处理完的资讯之后读取, 计数从断点累加
+        ## 断点之后乱序完成的批次在续跑时会重新处理, 写入按_key覆盖; 计数与断点一起推进, 不会重复
+        checkpoint = JobCheckpoint("news_pipeline", date_str)
+        done_count = checkpoint.get("done_count", 0)
+        position = checkpoint.get("position")
+        self.news_count = done_count
+        self.pipeline_count = checkpoint.get("pipeline_count", 0)
+        self.ignore_count = checkpoint.get("ignore_count", 0)
+        self.duplicate_count = checkpoint.get("duplicate_count", 0)
+        self.arango_count = checkpoint.get("arango_count", 0)
+
+        ## 只处理公众号资讯, 边读取边组装naf并分批, 不在内存中保留当天全部资讯
+        logger.info("采集时间为: {}, 从表: {} 读取资讯, 调用news pipeline接口服务".format(date_str, collection_name))
+        query = {"source": "公众号", "crawl_time": {"$gte": process_date, "$lte": next_date}}
+
+        ## news pipeline服务处理, 多个批次并发调用, 结果按返回先后写入arangodb
+        batcher = AdaptiveBatcher(BATCH_SIZE, BATCH_MIN_SIZE, BATCH_MAX_SIZE, BATCH_MAX_BYTES, BATCH_TARGET_LATENCY)
+        client = PipelineClient(NEWS_PIPELINE_URL, config=PIPELINE_CONFIG, pool_size=MAX_IN_FLIGHT, batcher=batcher, metrics=self.metrics)
+        cache = NlpResultCache()
+        batches = self.iter_naf_batches(news_collection, query, batcher, skip=done_count, position=position)
+        batches = self.iter_uncached_batches(batches, cache)
+
+        arango_connector = ArangoConnection(arangoURL=ARANGO_URL,
+                                            username=ARANGO_USER,
+                                            password=ARANGO_PASSWD)
+
+        arango_db = arango_connector[ARANGO_DB]
+        ## 计数按批次记录, 批次进入断点时才累加; 写入失败的文档从所属批次的计数中扣除, 该批次已进入断点时直接扣除总数
+        pending = {}            ## 批次起始序号 -> 该批次的计数, 进入断点后移除
+        written = {}            ## 上次断点之后加入writer的 _key -> 批次起始序号
+        def on_write_error(key, error):
+            self.dedup_index.remove(key)
+            index = written.pop(key, None)
+            if index in pending:
+                pending[index]["arango_count"] -= 1
+            elif index is not None:
+                self.arango_count -= 1
+
+        writer = ArangoBulkWriter(arango_db, ARANGO_COLLECTION, chunk_size=ARANGO_BULK_SIZE,
+                                  on_error=on_write_error, metrics=self.metrics)
+
+        ## 加载去重索引, 发布时间早于窗口的资讯去重时再补充加载
+        dedup_since = (process_date - datetime.timedelta(days=DEDUP_WINDOW_DAYS)).strftime("%Y-%m-%d")
+        with self.metrics.stage("dedup_load") as sizes:
+            self.dedup_index.load(arango_db, dedup_since, before_load=writer.flush)
+            sizes["docs"] = len(self.dedup_index.block_keys)
+
+        finished = {}           ## 已结束但之前仍有批次在途的 起始序号 -> 结束序号
+        batch_num = 0
+        for (index, naf_batch, keys, cached), misses, process_naf_list, elapsed in client.dispatch(batches, max_in_flight=MAX_IN_FLIGHT):
+            end = index + len(naf_batch)
+            pending[index] = dict.fromkeys(["pipeline_count", "ignore_count", "duplicate_count", "arango_count"], 0)
+            if process_naf_list is None:
                 logger.error("第 {} - {} 条数据处理失败".format(index, end))
-            
-            index = end
+            else:
+                logger.info("news pipeline返回结果, 其中缓存命中 {} 条".format(len(naf_batch) - len(misses)))
+                process_naf_list = self.merge_cached(naf_batch, keys, cached, process_naf_list, cache)
+                batch_start_time = time.time()
+                self.save_batch(index, naf_batch, process_naf_list, writer, pending[index], written)
+                batch_end_time = time.time()
+                logger.info("第 {} - {} 条数据处理结束, 服务耗时: {} 秒, 入库耗时: {} 秒"
+                            .format(index, end, int(elapsed), int(batch_end_time - batch_start_time)))
+
+            ## 断点只推进到连续完成的批次为止, 写断点前先把缓存的文档写入arangodb
+            finished[index] = end
+            while done_count in finished:
+                for name, value in pending.pop(done_count).items():
+                    setattr(self, name, getattr(self, name) + value)
+                done_count = finished.pop(done_count)
+                position = self.batch_positions.pop(done_count)
+            batch_num += 1
+            if batch_num % CHECKPOINT_INTERVAL == 0:
+                writer.flush()
+                written.clear()
+                self.save_checkpoint(checkpoint, done_count, position)
+
+        client.close()
+        cache.close()
+        writer.flush()
+        self.save_checkpoint(checkpoint, done_count, position, completed=True)
 
         ## 输出处理结果
         end_time = time.time()
         logger.info("本次news pipeline处理完成，共耗时: {} 秒".format(int(end_time - start_time)))
         logger.info("其中清洗库共 {} 条数据, pipeline共处理 {} 条数据, 其中无关数据 {} 条, 相似数据 {} 条, 导入arango {} 条数据"
                     .format(self.news_count, self.pipeline_count, self.ignore_count, self.duplicate_count, self.arango_count))
+        logger.info("nlp结果缓存命中 {} 条, 未命中 {} 条".format(cache.hit_count, cache.miss_count))
+
+        for name in ["news_count", "pipeline_count", "ignore_count", "duplicate_count", "arango_count"]:
+            self.metrics.set_count(name, getattr(self, name))
+        self.metrics.set_count("cache_hit_count", cache.hit_count)
+        self.metrics.write()
 
 
 if __name__ == '__main__':
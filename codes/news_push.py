@@ -19,6 +19,7 @@ import hashlib
 import base64
 import urllib.parse
 from elasticsearch import Elasticsearch
+from job_metrics import JobMetrics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -52,6 +53,7 @@ class NewsPush():
         process_date = datetime.datetime.strftime(process_date, "%Y-%m-%d")
         pre_date = datetime.datetime.strftime(pre_date, "%Y-%m-%d")                 ##  搜集近一周的资讯
 
+        metrics = JobMetrics("news_push", date_str)
         es = Elasticsearch(ES_URL)
         query = {
             "query": {
@@ -75,7 +77,9 @@ class NewsPush():
 
         response = None
         try:
-            response = es.search(index=NEWS_INDEX, body=query)
+            with metrics.stage("read") as sizes:
+                response = es.search(index=NEWS_INDEX, body=query)
+                sizes["docs"] = len(response["hits"]["hits"])
         except Exception as e:
             logger.error("资讯es查询错误: {}".format(str(e)))
             return
@@ -106,7 +110,8 @@ class NewsPush():
 
                         company_response = None
                         try:
-                            company_response = es.get(index=COMPANY_INDEX, doc_type=COMPANY_TYPE, id=company_id)
+                            with metrics.stage("read_company", docs=1):
+                                company_response = es.get(index=COMPANY_INDEX, doc_type=COMPANY_TYPE, id=company_id)
                         except Exception as e:
                             logger.error("查询企业es错误: {}".format(str(e)))
 
@@ -121,7 +126,8 @@ class NewsPush():
                         }
                     }
                     try:
-                        update_response = es.update(index=NEWS_INDEX, doc_type=NEWS_TYPE, id=result["_id"], body=update_doc)
+                        with metrics.stage("write", docs=1):
+                            update_response = es.update(index=NEWS_INDEX, doc_type=NEWS_TYPE, id=result["_id"], body=update_doc)
                     except Exception as e:
                         logger.error("修改资讯推送状态失败, id: {}".format(result["_id"]))
 
@@ -138,8 +144,11 @@ class NewsPush():
 
         links.extend(contents)
 
+        metrics.set_count("news_count", news_count)
+        metrics.set_count("company_count", len(company_set))
         if not news_count:
             logger.info("今日无资讯推送")
+            metrics.write()
             return
         
         ## 配置推送群信息
@@ -165,13 +174,16 @@ class NewsPush():
             }
 
             data = json.dumps(data)
-            response = requests.post(url=DING_URL, data=data, headers=headers)
+            with metrics.stage("remote_call", docs=news_count, nbytes=len(data)):
+                response = requests.post(url=DING_URL, data=data, headers=headers)
             response = response.json()
             if response["errcode"]:
                 logger.error("钉钉群[{}]推送消息失败, 错误码: {}, 错误原因: {}".format(dest_group[i], response["errcode"], response["errmsg"]))
             else:
                 logger.info("钉钉推[{}]送消息成功, 共推送消息 {} 条".format(dest_group[i], news_count))
 
+        metrics.write()
+
 
 if __name__ == "__main__":
     news_push = NewsPush()
@@ -0,0 +1,127 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : nlp_cache.py
+# Description  : nlp pipeline结果缓存；按资讯内容与组件列表的hash保存返回的naf/messages,
+#                本地sqlite存储, 超出容量时按最近访问时间淘汰
+#******************************************************************************
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+## 缓存文件
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "nlp_cache.db")
+
+## 缓存容量上限(压缩后字节数)
+MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+## sqlite单条语句参数个数上限
+SQLITE_MAX_VARIABLES = 500
+
+
+class NlpResultCache(object):
+
+    def __init__(self, path=None, max_bytes=None):
+        path = path or CACHE_PATH
+        self.max_bytes = max_bytes or MAX_BYTES
+        self.hit_count = 0
+        self.miss_count = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS nlp_result (
+                                        key TEXT PRIMARY KEY,
+                                        value BLOB NOT NULL,
+                                        size INTEGER NOT NULL,
+                                        access_time REAL NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS idx_access_time ON nlp_result (access_time)")
+        self.connection.commit()
+
+        ## 缓存总字节数只在打开时统计一次, 之后随写入与淘汰更新
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM nlp_result").fetchone()[0]
+
+
+    ## 缓存key: 标题、正文、企业名与组件列表的hash, 组件变化后不会命中旧结果
+    @staticmethod
+    def make_key(metadata, components):
+        raw = json.dumps([metadata["title"], metadata["content"], metadata.get("search_key"), components], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+    ## 批量查询, 返回 key -> 结果
+    def get_many(self, keys):
+        results = {}
+        keys = list(set(keys))
+        for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[i : i + SQLITE_MAX_VARIABLES]
+            query = "SELECT key, value FROM nlp_result WHERE key IN ({})".format(",".join("?" * len(chunk)))
+            for key, value in self.connection.execute(query, chunk):
+                results[key] = json.loads(zlib.decompress(value).decode("utf-8"))
+
+        if results:
+            now = time.time()
+            self.connection.executemany("UPDATE nlp_result SET access_time=? WHERE key=?", [(now, key) for key in results])
+            self.connection.commit()
+
+        self.hit_count += len(results)
+        self.miss_count += len(keys) - len(results)
+        return results
+
+
+    ## 已缓存的key -> 字节数, 用于覆盖写入时扣除旧值的大小
+    def get_sizes(self, keys):
+        sizes = {}
+        keys = list(set(keys))
+        for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[i : i + SQLITE_MAX_VARIABLES]
+            query = "SELECT key, size FROM nlp_result WHERE key IN ({})".format(",".join("?" * len(chunk)))
+            sizes.update(self.connection.execute(query, chunk))
+        return sizes
+
+
+    ## 批量写入, items为 (key, 结果) 列表
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        rows = {}
+        for key, result in items:
+            value = zlib.compress(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+            rows[key] = (key, value, len(value), now)
+        rows = list(rows.values())
+        old_sizes = self.get_sizes([row[0] for row in rows])
+        self.total_bytes += sum(row[2] for row in rows) - sum(old_sizes.values())
+        self.connection.executemany("INSERT OR REPLACE INTO nlp_result (key, value, size, access_time) VALUES (?, ?, ?, ?)", rows)
+        self.connection.commit()
+        self.evict()
+
+
+    ## 超出容量时淘汰最久未访问的结果, 淘汰到容量的90%
+    def evict(self):
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * 0.9
+        cursor = self.connection.execute("SELECT key, size FROM nlp_result ORDER BY access_time")
+        keys = []
+        for key, size in cursor:
+            if total <= target:
+                break
+            keys.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM nlp_result WHERE key=?", keys)
+        self.connection.commit()
+        self.total_bytes = total
+        logger.info("nlp结果缓存超出容量, 淘汰 {} 条".format(len(keys)))
+
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,121 @@
+#!/home/liangzhi/anaconda3/bin/python3
+#-*- coding: utf-8 -*-
+#******************************************************************************
+# Filename     : pipeline_client.py
+# Description  : nlp pipeline服务调用客户端；复用keep-alive连接，支持限制并发数的批量调用
+#******************************************************************************
+
+import json
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+## 单次请求超时时间(秒)
+REQUEST_TIMEOUT = 600
+
+
+class PipelineClient(object):
+
+    def __init__(self, url, config=None, pool_size=10, timeout=REQUEST_TIMEOUT, batcher=None, metrics=None):
+        self.url = url
+        self.config = config            ## pipeline组件配置, 为空时只发送documents
+        self.timeout = timeout
+        self.batcher = batcher          ## AdaptiveBatcher, 用于反馈每批耗时
+        self.metrics = metrics          ## JobMetrics, 记录remote_call阶段
+
+        ## 连接池大小不小于并发数, 保证每个线程都能复用长连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+
+    ## 调用一次服务, 成功返回body, 失败抛出异常
+    def post(self, documents):
+        if not documents:
+            return []
+
+        post_data = {"documents": documents}
+        if self.config:
+            post_data["config"] = self.config
+
+        data = json.dumps(post_data)
+        start_time = time.time()
+        response = self.session.post(self.url, data=data, timeout=self.timeout)
+        if self.metrics:
+            self.metrics.record("remote_call", time.time() - start_time, len(documents), len(data))
+        if response.status_code != 200:
+            raise Exception("pipeline服务返回状态码: {}".format(response.status_code))
+        return response.json().get("body")
+
+
+    ## 调用失败时将批次对半拆分重试, 直到单篇文档; 单篇仍失败时对应位置的结果为None
+    def post_with_split(self, documents):
+        try:
+            return self.post(documents)
+        except Exception as e:
+            if len(documents) <= 1:
+                logger.error("单篇文档调用pipeline服务失败: {}".format(str(e)))
+                return [None] * len(documents)
+            logger.info("{} 篇文档调用pipeline服务失败, 拆分重试: {}".format(len(documents), str(e)))
+            middle = len(documents) // 2
+            return self.post_with_split(documents[ : middle]) + self.post_with_split(documents[middle : ])
+
+
+    ## 调用一个批次, 返回 (body, 耗时); 耗时反馈给batcher, 失败时拆分重试
+    def post_batch(self, documents):
+        start_time = time.time()
+        try:
+            body = self.post(documents)
+        except Exception as e:
+            if self.batcher:
+                self.batcher.observe_failure()
+            middle = len(documents) // 2
+            if middle == 0:
+                raise
+            logger.info("{} 篇文档调用pipeline服务失败, 拆分重试: {}".format(len(documents), str(e)))
+            body = self.post_with_split(documents[ : middle]) + self.post_with_split(documents[middle : ])
+        else:
+            if self.batcher:
+                self.batcher.observe(len(documents), time.time() - start_time)
+        return body, time.time() - start_time
+
+
+    ## 并发调用服务, batches为 (tag, documents) 的可迭代对象
+    ## 按完成先后返回 (tag, documents, body, 耗时), 调用失败时body为None; ordered为True时按提交顺序返回
+    ## 同一时刻最多max_in_flight个批次在途, batches可以是生成器, 按需取数
+    def dispatch(self, batches, max_in_flight=1, ordered=False):
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            pending = OrderedDict()
+
+            def collect(futures):
+                for future in futures:
+                    tag, documents = pending.pop(future)
+                    try:
+                        body, elapsed = future.result()
+                    except Exception as e:
+                        logger.error("调用pipeline服务出错: {}".format(str(e)))
+                        body, elapsed = None, 0
+                    yield tag, documents, body, elapsed
+
+            def next_done():
+                if ordered:
+                    return [next(iter(pending))]
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                return done
+
+            for tag, documents in batches:
+                if len(pending) >= max_in_flight:
+                    yield from collect(next_done())
+                pending[executor.submit(self.post_batch, documents)] = (tag, documents)
+
+            while pending:
+                yield from collect(next_done())
+
+    def close(self):
+        self.session.close()